@@ -1,44 +1,449 @@
-from collections import namedtuple
+from collections import Counter, deque, namedtuple
+import time
 import urllib
 
-from google.appengine.api import urlfetch
-from google.appengine.ext import ndb
+from . import validator
+from .transport import UrlfetchTransport
 
 TRACKING_URI = 'https://ssl.google-analytics.com/collect'
+BATCH_URI = 'https://ssl.google-analytics.com/batch'
 
+# see:
+# https://developers.google.com/analytics/devguides/collection/protocol/v1/devguide#batch-limitations
+BATCH_MAX_HITS = 20
+BATCH_MAX_BYTES = 16 * 1024
+HIT_MAX_BYTES = 8 * 1024
 
-def _request(ctx, data, extra_headers, deadline=None):
+# Google Analytics discards hits queued for longer than four hours.
+QUEUE_TIME_MAX = 4 * 60 * 60
+# Size of a hit leaving room for the 'qt' parameter.
+QUEUED_HIT_MAX_BYTES = HIT_MAX_BYTES - len('&qt=%d' % (QUEUE_TIME_MAX * 1000))
+
+VALIDATE_OFF = 'off'
+VALIDATE_DROP = 'drop-invalid'
+VALIDATE_RAISE = 'raise'
+VALIDATE_ANNOTATE = 'annotate'
+_VALIDATE_MODES = (VALIDATE_OFF, VALIDATE_DROP, VALIDATE_RAISE,
+                   VALIDATE_ANNOTATE)
+
+
+class InvalidHit(validator.ValidationError):
+    """A hit rejected by `payloads()` validating with `VALIDATE_RAISE`."""
+
+    def __init__(self, payload, errors):
+        super(InvalidHit, self).__init__(
+            'Invalid hit parameters: %s' % ', '.join(sorted(errors)))
+        self.payload = payload
+        self.errors = errors
+
+
+class AnnotatedPayload(dict):
+    """A final payload checked with `VALIDATE_ANNOTATE`.
+
+    `errors` maps its invalid parameters to error messages, as returned by
+    `validator.validate_payload()`.
+    """
+    __slots__ = ('errors',)
+
+
+class ValidationStats(object):
+    """Counters of the hits checked by the validation stage of `payloads()`.
+
+    `errors` counts invalid hits per offending parameter. `annotated` holds
+    the last `keep` invalid hits sent with `VALIDATE_ANNOTATE`, as
+    `AnnotatedPayload`s.
+    """
+
+    def __init__(self, keep=100):
+        self.hits = 0
+        self.invalid = 0
+        self.dropped = 0
+        self.errors = Counter()
+        self.annotated = deque(maxlen=keep)
+
+    def record(self, errors, dropped):
+        self.hits += 1
+        if errors:
+            self.invalid += 1
+            self.errors.update(errors.iterkeys())
+        if dropped:
+            self.dropped += 1
+
+
+_default_transport = UrlfetchTransport()
+
+_hooks = None
+
+
+def set_hooks(hooks):
+    """Install `hooks`, a `hooks.Hooks`, or remove them with `None`.
+
+    Hooks are process-wide and fired by every reporting function. Returns
+    the hooks installed before.
+    """
+    global _hooks
+    previous, _hooks = _hooks, hooks
+    return previous
+
+
+def _completed(hooks, future, uri, data, started):
+    seconds = time.time() - started
+    exception = future.get_exception()
+    if exception is not None:
+        hooks.request_completed(uri, data, seconds, exception=exception)
+    else:
+        hooks.request_completed(uri, data, seconds,
+                                response=future.get_result())
+
+
+def _request(transport, data, extra_headers, deadline=None, uri=TRACKING_URI):
+    if transport is None:
+      transport = _default_transport
     if extra_headers is None:
       extra_headers = dict()
-    if deadline is None:
-      deadline = urlfetch.get_default_fetch_deadline()
-    return ctx.urlfetch(TRACKING_URI, payload=urllib.urlencode(data), method="POST", headers=extra_headers, deadline=deadline)
+    if not isinstance(data, basestring):
+      data = urllib.urlencode(data)
+    hooks = _hooks
+    if hooks is None:
+      return transport.post(uri, data, extra_headers, deadline)
+    hooks.request_sent(uri, data)
+    started = time.time()
+    future = transport.post(uri, data, extra_headers, deadline)
+    future.add_callback(_completed, hooks, future, uri, data, started)
+    return future
+
+
+def batches(hits):
+    """Group URL-encoded hits into bodies for the `/batch` endpoint.
+
+    Generates newline-delimited strings holding at most `BATCH_MAX_HITS` hits
+    and `BATCH_MAX_BYTES` bytes each. Raises `ValueError` for a hit larger
+    than `HIT_MAX_BYTES`, which Google Analytics would reject anyway.
+    """
+    batch = []
+    size = 0
+    for hit in hits:
+        if len(hit) > HIT_MAX_BYTES:
+            raise ValueError('Hit exceeds %d bytes' % HIT_MAX_BYTES)
+        if batch and (len(batch) >= BATCH_MAX_HITS or
+                      size + 1 + len(hit) > BATCH_MAX_BYTES):
+            yield '\n'.join(batch)
+            batch = []
+            size = 0
+        if batch:
+            size += 1
+        size += len(hit)
+        batch.append(hit)
+    if batch:
+        yield '\n'.join(batch)
+
+
+def _requests(tracking_id, client_id, requestable, extra_info,
+              extra_headers, batch, validate, validation_stats, sampler,
+              dedup=None):
+    """Return the list of (uri, body, keys) triples of the requests to make.
+
+    All bodies are built before returning, so that no request is made when
+    a hit is invalid or, in batch mode, too large. Hits `dedup` finds to be
+    duplicates are dropped; `keys` are the fingerprints claimed for the
+    others, or `None`, to be settled with `_settle()` once sent.
+    """
+    hits = [hit for hit, _ in encoded_payloads(
+        tracking_id, client_id, requestable, extra_info, extra_headers,
+        validate, validation_stats, sampler)]
+    keys = None
+    if dedup is not None:
+        claimed = zip(hits, dedup.claim_all(hits))
+        hits = [hit for hit, key in claimed if key is not None]
+        keys = [key for _, key in claimed if key is not None]
+        if _hooks is not None:
+            for _ in range(len(claimed) - len(hits)):
+                _hooks.hit_dropped('duplicate')
+    if not batch:
+        return [(TRACKING_URI, hit, keys and keys[i:i + 1])
+                for i, hit in enumerate(hits)]
+    try:
+        bodies = list(batches(hits))
+    except ValueError:
+        _settle(dedup, keys, False)
+        raise
+    requests = []
+    start = 0
+    for body in bodies:
+        end = start + body.count('\n') + 1
+        requests.append((BATCH_URI, body, keys and keys[start:end]))
+        start = end
+    return requests
+
+
+def _settle(dedup, keys, succeeded):
+    """Confirm the fingerprints claimed for a request, or release them."""
+    if keys:
+        for key in keys:
+            if succeeded:
+                dedup.confirm(key)
+            else:
+                dedup.release(key)
+
+
+def _settled(dedup, keys, future):
+    """Settle `keys` once `future`, a request, is done."""
+    _settle(dedup, keys, future.get_exception() is None and
+            future.get_result().status_code < 400)
+
+
+def stamp_queue_time(hit, enqueued, now=None):
+    """Set the 'qt' parameter of a URL-encoded hit queued since `enqueued`.
+
+    The time spent queued is added to the queue time the hit already had.
+    Returns `None` for a hit queued for longer than `QUEUE_TIME_MAX` seconds,
+    which Google Analytics would discard anyway.
+    """
+    if now is None:
+        now = time.time()
+    queued = max(int((now - enqueued) * 1000), 0)
+    if hit.startswith('qt=') or '&qt=' in hit:
+        params = hit.split('&')
+        for i, param in enumerate(params):
+            if param.startswith('qt='):
+                if param[3:].isdigit():
+                    queued += int(param[3:])
+                del params[i]
+                break
+        hit = '&'.join(params)
+    if queued > QUEUE_TIME_MAX * 1000:
+        return None
+    return '%s&qt=%d' % (hit, queued)
 
 
 def report_async(tracking_id, client_id, requestable, extra_info=None,
-           extra_headers=None, deadline=None):
-    """Actually report measurements to Google Analytics."""
-    ctx = ndb.get_context()
-    return [_request(ctx, data, extra_headers, deadline)
-            for data, extra_headers in payloads(
-            tracking_id, client_id, requestable, extra_info, extra_headers)]
+           extra_headers=None, deadline=None, batch=False,
+           validate=VALIDATE_OFF, validation_stats=None, transport=None,
+           sampler=None, dedup=None):
+    """Actually report measurements to Google Analytics.
+
+    Returns a list of futures, one per hit. With `batch=True` hits are sent
+    to the `/batch` endpoint instead and there is one future per batch.
+
+    Requests go through `transport`, a `transport.Transport` which defaults
+    to URL Fetch. Hits are only sent if `sampler`, a `sampling.Sampler`,
+    lets them through, and if `dedup`, a `dedup.Deduplicator`, has not seen
+    them sent recently. Hits of failed requests are released from `dedup`,
+    so that they can be reported again.
+
+    All hits are built before the first one is sent, so nothing is sent
+    when validation raises, see `payloads()`, or when a hit is larger than
+    `HIT_MAX_BYTES` in batch mode, which raises `ValueError`.
+    """
+    futures = []
+    for uri, body, keys in _requests(
+            tracking_id, client_id, requestable, extra_info, extra_headers,
+            batch, validate, validation_stats, sampler, dedup):
+        future = _request(transport, body, extra_headers, deadline, uri=uri)
+        if keys:
+            future.add_callback(_settled, dedup, keys, future)
+        futures.append(future)
+    return futures
 
 
 def report(tracking_id, client_id, requestable, extra_info=None,
-           extra_headers=None, deadline=None):
-    futures = report_async(tracking_id, client_id, requestable, extra_info, extra_headers, deadline=deadline)
+           extra_headers=None, deadline=None, batch=False,
+           validate=VALIDATE_OFF, validation_stats=None, transport=None,
+           sampler=None, dedup=None, retry=None, dead_letter=None):
+    """Report measurements and generate the responses.
+
+    With a `retry.RetryPolicy` as `retry`, failed requests are retried and
+    those failing for good are passed to `dead_letter`; see
+    `RetryPolicy.send()`.
+    """
+    if retry is not None:
+      requests = _requests(
+          tracking_id, client_id, requestable, extra_info, extra_headers,
+          batch, validate, validation_stats, sampler, dedup)
+      # Responses and dead letters come in the order of the requests.
+      unsettled = deque(keys for _, _, keys in requests)
+
+      def failed(uri, body, headers, error):
+        _settle(dedup, unsettled.popleft(), False)
+        dead_letter(uri, body, headers, error)
+
+      try:
+        for response in retry.send(
+            transport or _default_transport,
+            [(uri, body) for uri, body, _ in requests], extra_headers or {},
+            deadline, failed if dead_letter is not None else None):
+          _settle(dedup, unsettled.popleft(), response.status_code < 400)
+          yield response
+      finally:
+        for keys in unsettled:
+          _settle(dedup, keys, False)
+      return
+    futures = report_async(
+        tracking_id, client_id, requestable, extra_info, extra_headers,
+        deadline=deadline, batch=batch, validate=validate,
+        validation_stats=validation_stats, transport=transport,
+        sampler=sampler, dedup=dedup)
     for future in futures:
       future.check_success()
       yield future.get_result()
 
 
 def payloads(tracking_id, client_id, requestable, extra_info=None,
-             extra_headers=None):
+             extra_headers=None, validate=VALIDATE_OFF, validation_stats=None):
     """Get data and headers of API requests for Google Analytics.
 
     Generates a sequence of (data, headers) pairs. Both `data` and `headers`
     are dicts.
+
+    `validate` checks every hit with `validator.validate_payload()`. Invalid
+    hits are skipped with `VALIDATE_DROP` and raise `InvalidHit` with
+    `VALIDATE_RAISE`. With `VALIDATE_ANNOTATE` all hits are kept, and `data`
+    is an `AnnotatedPayload` holding the errors found. Results are counted
+    in `validation_stats` if given.
+    """
+    if validate not in _VALIDATE_MODES:
+        raise ValueError('Unknown validation mode: %r' % (validate,))
+    extra_payload = _common_payload(tracking_id, client_id, extra_info)
+
+    for request_payload in requestable:
+        if validate == VALIDATE_ANNOTATE:
+            final_payload = AnnotatedPayload(request_payload)
+        else:
+            final_payload = dict(request_payload)
+        final_payload.update(extra_payload)
+        if validate != VALIDATE_OFF:
+            errors = validator.validate_payload(final_payload)
+            if validation_stats is not None:
+                validation_stats.record(
+                    errors, dropped=errors and validate == VALIDATE_DROP)
+            if validate == VALIDATE_ANNOTATE:
+                final_payload.errors = errors
+                if errors and validation_stats is not None:
+                    validation_stats.annotated.append(final_payload)
+            if errors and validate == VALIDATE_RAISE:
+                raise InvalidHit(final_payload, errors)
+            if errors and validate == VALIDATE_DROP:
+                if _hooks is not None:
+                    _hooks.hit_dropped('invalid')
+                continue
+        yield final_payload, extra_headers
+
+
+def encoded_payloads(tracking_id, client_id, requestable, extra_info=None,
+                     extra_headers=None, validate=VALIDATE_OFF,
+                     validation_stats=None, sampler=None):
+    """Get URL-encoded data and headers of API requests.
+
+    Same as `payloads()` but generates (data, headers) pairs where `data` is
+    the request body, encoded with a `PayloadEncoder`.
+
+    With `sampler`, a `sampling.Sampler`, hits of clients outside the sample
+    are skipped, and the hits sent to a property are either all within its
+    rate limits or all skipped.
+
+    `tracking_id` may also be a list of tracking IDs or `Property`s, to send
+    a copy of each hit to every property. Hits are built, validated and
+    encoded once; only the common parameters differ between copies, except
+    for properties with overrides which encode their copies themselves.
+    """
+    hooks = _hooks
+    properties = _properties(tracking_id)
+    if sampler is not None and not sampler.sample(client_id):
+        # Counting hits does not need to build them.
+        for _ in _iter_hits(requestable):
+            for _ in properties:
+                sampler.sampled_out += 1
+                if hooks is not None:
+                    hooks.hit_dropped('sampled')
+        return
+    tracking_id = properties[0].tracking_id
+    encoder = PayloadEncoder(tracking_id, client_id, extra_info)
+    encoders = [
+        encoder if not prop.overrides and prop.tracking_id == tracking_id else
+        PayloadEncoder(prop.tracking_id, client_id,
+                       list(extra_info or ()) + [prop.overrides or {}])
+        for prop in properties]
+    if validate == VALIDATE_OFF:
+        hits = _iter_hits(requestable)
+    else:
+        hits = (data for data, _ in payloads(
+            tracking_id, client_id, requestable, extra_info, extra_headers,
+            validate, validation_stats))
+    if hooks is not None:
+        hits = _timed(hits, hooks.payload_built)
+    if sampler is not None:
+        hits = [hit if isinstance(hit, dict) else dict(hit) for hit in hits]
+        allowed = [_allowed(sampler, prop, client_id, hits, hooks)
+                   for prop in properties]
+    as_dict = (sampler is not None or len(properties) > 1 or
+               properties[0].filter is not None)
+    for hit in hits:
+        if as_dict and not isinstance(hit, dict):
+            hit = dict(hit)
+        shared = None
+        for index, (prop, prop_encoder) in enumerate(zip(properties,
+                                                         encoders)):
+            if sampler is not None and not allowed[index]:
+                continue
+            if prop.filter is not None and not prop.filter(hit):
+                continue
+            if hooks is not None:
+                started = time.time()
+            if prop.overrides:
+                data = prop_encoder.encode(hit)
+            elif shared is not None:
+                data = prop_encoder.prefix + shared
+            else:
+                data = encoder.encode(hit)
+                shared = data[len(encoder.prefix):]
+                if prop_encoder is not encoder:
+                    data = prop_encoder.prefix + shared
+            if hooks is not None:
+                hooks.payload_encoded(time.time() - started)
+            yield data, extra_headers
+
+
+def _allowed(sampler, prop, client_id, hits, hooks):
+    """Return whether `sampler` lets all `hits` through to `prop`, or none."""
+    hit_types = [hit.get('t') for hit in hits
+                 if prop.filter is None or prop.filter(hit)]
+    if not hit_types or sampler.allow_all(prop.tracking_id, client_id,
+                                          hit_types):
+        return True
+    if hooks is not None:
+        for _ in hit_types:
+            hooks.hit_dropped('limited')
+    return False
+
+
+def _iter_hits(requestable):
+    """Generate the hits of `requestable`, as dicts or (key, value) pairs.
+
+    Any iterable of payload dicts is accepted, as with `payloads()`.
     """
+    iter_hits = getattr(requestable, 'iter_hits', None)
+    if iter_hits is None:
+        return iter(requestable)
+    return iter_hits()
+
+
+def _timed(hits, callback):
+    """Pass on `hits`, calling `callback` with the time taken by each."""
+    hits = iter(hits)
+    while True:
+        started = time.time()
+        try:
+            hit = next(hits)
+        except StopIteration:
+            return
+        if not isinstance(hit, dict):
+            # Hits given as lazy pairs are built while being encoded.
+            hit = list(hit)
+        callback(time.time() - started)
+        yield hit
+
+
+def _common_payload(tracking_id, client_id, extra_info):
     extra_payload = {
         'v': '1',
         'tid': tracking_id,
@@ -47,118 +452,289 @@ def payloads(tracking_id, client_id, requestable, extra_info=None,
     if extra_info:
         for payload in extra_info:
             extra_payload.update(payload)
+    return extra_payload
 
-    for request_payload in requestable:
-        final_payload = dict(request_payload)
-        final_payload.update(extra_payload)
-        yield final_payload, extra_headers
+
+class Property(namedtuple('Property', 'tracking_id overrides filter')):
+    """A property to send copies of hits to, among others.
+
+    `overrides` is a dict of parameters replacing those of the hits, and
+    `filter` a function given each hit as a dict and returning whether to
+    send it to this property.
+    """
+    __slots__ = ()
+
+    def __new__(cls, tracking_id, overrides=None, filter=None):
+        return super(Property, cls).__new__(cls, tracking_id, overrides,
+                                            filter)
+
+
+def _properties(tracking_id):
+    """Return the list of `Property`s hits are sent to."""
+    if isinstance(tracking_id, (basestring, Property)):
+        tracking_id = [tracking_id]
+    properties = [prop if isinstance(prop, Property) else Property(prop)
+                  for prop in tracking_id]
+    if not properties:
+        raise ValueError('No tracking ID given')
+    return properties
+
+
+_quoted_keys = {}
+
+
+class PayloadEncoder(object):
+    """URL-encode hits sharing a tracking ID, client ID and extra info.
+
+    The common parameters are encoded once, so `encode()` only quotes the
+    parameters of the hit itself. As with `payloads()`, common parameters
+    take precedence over those of the hit, given either as a dict or as
+    (key, value) pairs.
+    """
+
+    def __init__(self, tracking_id, client_id, extra_info=None):
+        self.common = _common_payload(tracking_id, client_id, extra_info)
+        self.prefix = urllib.urlencode(self.common)
+
+    def encode(self, payload):
+        common = self.common
+        parts = [self.prefix]
+        if isinstance(payload, dict):
+            payload = payload.iteritems()
+        for key, value in payload:
+            if key in common:
+                continue
+            quoted_key = _quoted_keys.get(key)
+            if quoted_key is None:
+                quoted_key = _quoted_keys[key] = urllib.quote_plus(str(key))
+            parts.append(quoted_key + '=' + urllib.quote_plus(str(value)))
+        return '&'.join(parts)
+
+
+_overridden = {}
+
+
+def _overrides(cls, name, base):
+    """Return whether `cls` overrides method `name` of `base`."""
+    key = (cls, name, base)
+    overrides = _overridden.get(key)
+    if overrides is None:
+        method = getattr(cls, name)
+        original = getattr(base, name)
+        overrides = _overridden[key] = (
+            getattr(method, '__func__', method) is not
+            getattr(original, '__func__', original))
+    return overrides
 
 
 class Requestable(object):
+    __slots__ = ()
 
     def get_payload(self):
         raise NotImplementedError()
 
+    def iter_payload(self):
+        """Generate the (key, value) pairs of `get_payload()`."""
+        return self.get_payload().iteritems()
+
     def __iter__(self):
         yield self.get_payload()
 
+    def iter_hits(self):
+        """Generate the (key, value) pairs of every hit.
+
+        Unlike iterating over the requestable itself, this does not need to
+        build a dict per hit.
+        """
+        for payload in self:
+            yield payload.iteritems()
 
-class SystemInfo(Requestable, namedtuple('SystemInfo', 'language')):
+
+class _Hit(Requestable):
+    """A requestable of a single hit, emitting its parameters as pairs."""
+    __slots__ = ()
+
+    def get_payload(self):
+        return dict(self.iter_payload())
+
+    def iter_hits(self):
+        if _overrides(type(self), '__iter__', _Hit):
+            # Subclasses customising __iter__() may send other hits.
+            for hit in Requestable.iter_hits(self):
+                yield hit
+        else:
+            yield self._iter_hit()
+
+    def _iter_hit(self):
+        if _overrides(type(self), 'get_payload', _Hit):
+            # Send what subclasses customising get_payload() return, as
+            # when hits are built through __iter__().
+            return self.get_payload().iteritems()
+        return self.iter_payload()
+
+
+class SystemInfo(_Hit, namedtuple('SystemInfo', 'language')):
+    __slots__ = ()
 
     def __new__(cls, language=None):
         return super(SystemInfo, cls).__new__(cls, language)
 
-    def get_payload(self):
-        payload = {}
+    def iter_payload(self):
         if self.language:
-            payload['ul'] = self.language
-        return payload
+            yield 'ul', self.language
 
 
 class PageView(
-        Requestable,
+        _Hit,
         namedtuple('PageView',
                    'path host_name location title referrer')):
+    __slots__ = ()
 
     def __new__(cls, path=None, host_name=None, location=None, title=None,
                 referrer=None):
         return super(PageView, cls).__new__(cls, path, host_name, location,
                                             title, referrer)
 
-    def get_payload(self):
-        payload = {'t': 'pageview'}
+    def iter_payload(self):
+        yield 't', 'pageview'
         if self.location:
-            payload['dl'] = self.location
+            yield 'dl', self.location
         if self.host_name:
-            payload['dh'] = self.host_name
+            yield 'dh', self.host_name
         if self.path:
-            payload['dp'] = self.path
+            yield 'dp', self.path
         if self.title:
-            payload['dt'] = self.title
+            yield 'dt', self.title
         if self.referrer:
-            payload['dr'] = self.referrer
-        return payload
+            yield 'dr', self.referrer
 
 
-class Event(Requestable, namedtuple('Event', 'category action label value')):
+class Event(_Hit, namedtuple('Event', 'category action label value')):
+    __slots__ = ()
 
     def __new__(cls, category, action, label=None, value=None):
         return super(Event, cls).__new__(cls, category, action, label, value)
 
-    def get_payload(self):
-        payload = {
-            't': 'event',
-            'ec': self.category,
-            'ea': self.action}
+    def iter_payload(self):
+        yield 't', 'event'
+        yield 'ec', self.category
+        yield 'ea', self.action
         if self.label:
-            payload['el'] = self.label
+            yield 'el', self.label
         if self.value:
-            payload['ev'] = str(int(self.value))
-        return payload
+            yield 'ev', str(int(self.value))
+
+
+def sum_prices(prices, quantities=None):
+    """Add up prices, all in the same currency, optionally times quantities.
+
+    Net and gross amounts are summed as decimals, which is much faster than
+    adding prices one by one as each sum records its history. Raises
+    `ValueError` for prices in different currencies.
+    """
+    prices = list(prices)
+    if quantities is None:
+        quantities = [1] * len(prices)
+    currency = prices[0].currency
+    nets = []
+    grosses = []
+    taxed = False
+    for price, quantity in zip(prices, quantities):
+        if price.currency != currency:
+            raise ValueError('Cannot add price in %r to %r' %
+                             (price.currency, currency))
+        net = price.net
+        gross = price.gross
+        # Prices without tax share the same decimal for net and gross.
+        if gross is net:
+            if quantity != 1:
+                net = gross = net * quantity
+        else:
+            taxed = True
+            if quantity != 1:
+                net *= quantity
+                gross *= quantity
+        nets.append(net)
+        grosses.append(gross)
+    net = sum(nets)
+    gross = sum(grosses) if taxed else net
+    return type(prices[0])(net=net, gross=gross, currency=currency)
 
 
 class Transaction(
-        Requestable,
+        _Hit,
         namedtuple('Transaction',
                    'transaction_id items revenue shipping affiliation')):
+    # No __slots__ so that the total can be cached in the instance.
 
     def __new__(cls, transaction_id, items, revenue=None, shipping=None,
                 affiliation=None):
         if not items:
             raise ValueError('You need to specify at least one item')
         return super(Transaction, cls).__new__(
-            cls, transaction_id, items, revenue, shipping, affiliation)
+            cls, transaction_id, tuple(items), revenue, shipping, affiliation)
 
     def get_total(self):
+        """Return the revenue, or the sum of the items and shipping.
+
+        The total is computed once per transaction.
+        """
+        try:
+            return self._total
+        except AttributeError:
+            pass
         if self.revenue:
-            return self.revenue
-        prices = [i.get_subtotal() for i in self.items]
-        total = sum(prices[1:], prices[0])
-        if self.shipping:
-            total += self.shipping
+            total = self.revenue
+        else:
+            prices = []
+            quantities = []
+            for i in self.items:
+                if _overrides(type(i), 'get_subtotal', Item):
+                    prices.append(i.get_subtotal())
+                    quantities.append(1)
+                else:
+                    prices.append(i.unit_price)
+                    quantities.append(i.quantity or 1)
+            if self.shipping:
+                prices.append(self.shipping)
+                quantities.append(1)
+            total = sum_prices(prices, quantities)
+        self._total = total
         return total
 
-    def get_payload(self):
-        payload = {
-            't': 'transaction',
-            'ti': self.transaction_id}
+    def iter_payload(self):
+        yield 't', 'transaction'
+        yield 'ti', self.transaction_id
         if self.affiliation:
-            payload['ta'] = self.affiliation
+            yield 'ta', self.affiliation
         total = self.get_total()
-        payload['tr'] = str(total.gross)
-        payload['tt'] = str(total.tax)
-        payload['cu'] = total.currency
+        yield 'tr', str(total.gross)
+        yield 'tt', str(total.tax)
+        yield 'cu', total.currency
         if self.shipping:
-            payload['ts'] = str(self.shipping.gross)
-        return payload
+            yield 'ts', str(self.shipping.gross)
 
     def __iter__(self):
         yield self.get_payload()
         for i in self.items:
             yield i.get_payload_for_transaction(self.transaction_id)
 
+    def iter_hits(self):
+        if _overrides(type(self), '__iter__', Transaction):
+            for hit in Requestable.iter_hits(self):
+                yield hit
+            return
+        yield self._iter_hit()
+        for i in self.items:
+            if _overrides(type(i), 'get_payload_for_transaction', Item):
+                yield i.get_payload_for_transaction(
+                    self.transaction_id).iteritems()
+            else:
+                yield i.iter_payload_for_transaction(self.transaction_id)
+
 
 class Item(namedtuple('Item', 'name unit_price quantity item_id category')):
+    __slots__ = ()
 
     def __new__(cls, name, unit_price, quantity=None, item_id=None,
                 category=None):
@@ -171,16 +747,176 @@ class Item(namedtuple('Item', 'name unit_price quantity item_id category')):
         return self.unit_price
 
     def get_payload_for_transaction(self, transaction_id):
-        payload = {
-            't': 'item',
-            'ti': transaction_id,
-            'in': self.name}
-        payload['ip'] = str(self.unit_price.gross)
-        payload['cu'] = self.unit_price.currency
+        return dict(self.iter_payload_for_transaction(transaction_id))
+
+    def iter_payload_for_transaction(self, transaction_id):
+        yield 't', 'item'
+        yield 'ti', transaction_id
+        yield 'in', self.name
+        yield 'ip', str(self.unit_price.gross)
+        yield 'cu', self.unit_price.currency
         if self.quantity:
-            payload['iq'] = str(int(self.quantity))
+            yield 'iq', str(int(self.quantity))
         if self.item_id:
-            payload['ic'] = self.item_id
+            yield 'ic', self.item_id
         if self.category:
-            payload['iv'] = self.category
-        return payload
+            yield 'iv', self.category
+
+
+# Enhanced Ecommerce allows up to 200 products, impression lists and products
+# per impression list in a single hit.
+MAX_PRODUCTS = 200
+
+# Parameter suffixes in the order of the fields of `Product`, `None` for
+# fields impressions do not have.
+_PRODUCT_CODES = ('id', 'nm', 'br', 'ca', 'va', 'pr', 'qt', 'cc', 'ps')
+_IMPRESSION_CODES = ('id', 'nm', 'br', 'ca', 'va', 'pr', None, None, 'ps')
+
+_product_keys = {}
+
+
+def product_keys(index, list_index=None):
+    """Return the parameter names of the product at `index`, counting from 0.
+
+    Names are those of impression list `list_index` if given, and are in the
+    order of the fields of `Product`. They are built once per position.
+    """
+    position = (list_index, index)
+    keys = _product_keys.get(position)
+    if keys is None:
+        if list_index is None:
+            prefix = 'pr%d' % (index + 1)
+            codes = _PRODUCT_CODES
+        else:
+            prefix = 'il%dpi%d' % (list_index + 1, index + 1)
+            codes = _IMPRESSION_CODES
+        keys = _product_keys[position] = tuple(
+            code and prefix + code for code in codes)
+    return keys
+
+
+class Product(
+        namedtuple('Product',
+                   'product_id name brand category variant price quantity '
+                   'coupon position')):
+    __slots__ = ()
+
+    def __new__(cls, product_id=None, name=None, brand=None, category=None,
+                variant=None, price=None, quantity=None, coupon=None,
+                position=None):
+        if product_id is None and name is None:
+            raise ValueError('You need to specify a product ID or name')
+        return super(Product, cls).__new__(
+            cls, product_id, name, brand, category, variant, price, quantity,
+            coupon, position)
+
+    def iter_payload_at(self, keys):
+        """Generate the parameters of the product under `keys`.
+
+        `keys` come from `product_keys()`.
+        """
+        price = self.price
+        for key, value in zip(keys, self):
+            if key is None or value is None:
+                continue
+            if value is price:
+                value = str(price.gross)
+            yield key, value
+
+
+class ImpressionList(namedtuple('ImpressionList', 'name products')):
+    __slots__ = ()
+
+    def __new__(cls, name, products):
+        if len(products) > MAX_PRODUCTS:
+            raise ValueError('An impression list holds at most %d products' %
+                             MAX_PRODUCTS)
+        return super(ImpressionList, cls).__new__(cls, name, tuple(products))
+
+
+class ProductAction(
+        _Hit,
+        namedtuple('ProductAction',
+                   'hit action products impressions transaction_id '
+                   'affiliation revenue shipping coupon list_name '
+                   'checkout_step checkout_option')):
+    """Enhanced Ecommerce data sent along with `hit`, a page view or event.
+
+    All products and impressions are packed in that single hit. `action` may
+    be left out to only report impressions.
+    """
+    __slots__ = ()
+
+    def __new__(cls, hit, action=None, products=(), impressions=(),
+                transaction_id=None, affiliation=None, revenue=None,
+                shipping=None, coupon=None, list_name=None,
+                checkout_step=None, checkout_option=None):
+        if action is not None and not validator.is_pa(action):
+            raise ValueError('Unknown product action: %r' % (action,))
+        if action in ('purchase', 'refund') and not transaction_id:
+            raise ValueError('You need to specify a transaction ID')
+        if len(products) > MAX_PRODUCTS:
+            raise ValueError('A hit holds at most %d products' % MAX_PRODUCTS)
+        if len(impressions) > MAX_PRODUCTS:
+            raise ValueError('A hit holds at most %d impression lists' %
+                             MAX_PRODUCTS)
+        return super(ProductAction, cls).__new__(
+            cls, hit, action, tuple(products), tuple(impressions),
+            transaction_id, affiliation, revenue, shipping, coupon, list_name,
+            checkout_step, checkout_option)
+
+    def get_currency(self):
+        """Return the currency of all prices, `None` if there are none.
+
+        Raises `ValueError` for prices in different currencies.
+        """
+        prices = [self.revenue, self.shipping]
+        prices.extend(product.price for product in self.products)
+        for impression_list in self.impressions:
+            prices.extend(product.price
+                          for product in impression_list.products)
+        currency = None
+        for price in prices:
+            if price is None:
+                continue
+            if currency is None:
+                currency = price.currency
+            elif price.currency != currency:
+                raise ValueError('Cannot mix prices in %r and %r' %
+                                 (currency, price.currency))
+        return currency
+
+    def iter_payload(self):
+        for pair in self.hit._iter_hit():
+            yield pair
+        if self.action:
+            yield 'pa', self.action
+        if self.transaction_id:
+            yield 'ti', self.transaction_id
+        if self.affiliation:
+            yield 'ta', self.affiliation
+        if self.revenue:
+            yield 'tr', str(self.revenue.gross)
+            yield 'tt', str(self.revenue.tax)
+        if self.shipping:
+            yield 'ts', str(self.shipping.gross)
+        if self.coupon:
+            yield 'tcc', self.coupon
+        if self.list_name:
+            yield 'pal', self.list_name
+        if self.checkout_step is not None:
+            yield 'cos', self.checkout_step
+        if self.checkout_option:
+            yield 'col', self.checkout_option
+        currency = self.get_currency()
+        if currency:
+            yield 'cu', currency
+        for index, product in enumerate(self.products):
+            for pair in product.iter_payload_at(product_keys(index)):
+                yield pair
+        for list_index, impression_list in enumerate(self.impressions):
+            yield 'il%dnm' % (list_index + 1), impression_list.name
+            for index, product in enumerate(impression_list.products):
+                for pair in product.iter_payload_at(
+                        product_keys(index, list_index)):
+                    yield pair
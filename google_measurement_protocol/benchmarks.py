@@ -0,0 +1,480 @@
+"""
+Benchmarks, run with `python -m google_measurement_protocol.benchmarks`.
+
+Each benchmark returns a dict mapping a case name to microseconds per call.
+Results can be saved as JSON with `--json` and compared with those of
+another version with `--compare`. URL Fetch calls go to the App Engine
+stub, so no request leaves the machine.
+"""
+from __future__ import print_function
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import urllib
+import uuid
+
+from . import (Event, Item, PageView, PayloadEncoder, Product, ProductAction,
+               SystemInfo, BATCH_URI, TRACKING_URI, Transaction,
+               encoded_payloads, iso4217, payloads, report_async, set_hooks,
+               sum_prices, validator)
+from .hooks import Metrics
+
+BENCHMARKS = []
+
+
+def benchmark(func):
+    BENCHMARKS.append(func)
+    return func
+
+
+def measure(func, number):
+    '''Return the best time of `func()` in microseconds per call.'''
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6
+
+
+def measure_each(func, values):
+    '''Return the best time of `func(value)` in microseconds per value.'''
+    def run():
+        for value in values:
+            func(value)
+    return min(timeit.repeat(run, number=1, repeat=3)) / len(values) * 1e6
+
+
+def _times(number, scale):
+    return max(int(number * scale), 1)
+
+
+def _transaction(count):
+    from prices import Price
+    items = [Item('item-%04d' % i, Price(10, currency='USD'), quantity=2,
+                  item_id='SKU%04d' % i, category='category')
+             for i in range(count)]
+    return Transaction('trans-01', items, shipping=Price(5, currency='USD'))
+
+
+CLIENT_ID = '35009a79-1a05-49d7-b876-2b884d0f825b'
+
+# Valid values of parameters which are neither free text nor numbers.
+SAMPLES = {
+    'aip': 1,
+    'cid': CLIENT_ID,
+    'cu': 'EUR',
+    'dh': 'www.example.com',
+    'dl': 'http://www.example.com/products/shoes?color=blue',
+    'dp': '/products/shoes',
+    'dr': 'http://www.example.org/search?q=shoes',
+    'pa': 'purchase',
+    'sc': 'start',
+    't': 'pageview',
+    'tid': 'UA-123456-1',
+    'uip': '2607:f0d0:1002:51::4',
+    'v': '1',
+}
+
+
+@benchmark
+def building(scale=1.0):
+    number = _times(1000, scale)
+    info = SystemInfo(language='en-gb')
+    results = {}
+    for name, requestable in (
+            ('PageView', PageView('/my-page/', title='My Page')),
+            ('Event', Event('category', 'action', label='label', value=7)),
+            ('Transaction with 100 items', _transaction(100))):
+        results['payloads(%s)' % name] = measure(
+            lambda: list(payloads('UA-123456-1', CLIENT_ID, requestable,
+                                  info)), number)
+    return results
+
+
+@benchmark
+def encoding(scale=1.0):
+    number = _times(10000, scale)
+    info = SystemInfo(language='en-gb')
+    event = Event('category', 'action', label='label', value=7)
+    (data, _), = payloads('UA-123456-1', CLIENT_ID, event, info)
+    encoder = PayloadEncoder('UA-123456-1', CLIENT_ID, info)
+    (pairs,) = event.iter_hits()
+    pairs = list(pairs)
+    return {
+        'urllib.urlencode(Event)': measure(
+            lambda: urllib.urlencode(data), number),
+        'PayloadEncoder.encode(Event)': measure(
+            lambda: encoder.encode(pairs), number),
+    }
+
+
+@benchmark
+def validators(scale=1.0):
+    number = _times(10000, scale)
+    results = {}
+    for name in sorted(dir(validator)):
+        func = getattr(validator, name)
+        if not name.startswith('is_') or not callable(func):
+            continue
+        param = name[len('is_'):]
+        value = SAMPLES.get(param, 'value')
+        if not func(value):
+            value = 1
+        results[name] = measure(lambda: func(value), number)
+    (hit, _), = payloads('UA-123456-1', CLIENT_ID,
+                         PageView(location=SAMPLES['dl'], title='title',
+                                  referrer=SAMPLES['dr']),
+                         SystemInfo(language='en-gb'))
+    results['validate_payload(PageView)'] = measure(
+        lambda: validator.validate_payload(hit), number)
+    return results
+
+
+@benchmark
+def enumerated_validators(scale=1.0):
+    # Lookups in a Domain take the same time wherever the value is, unlike
+    # scanning the tuple of currency codes.
+    number = _times(100000, scale)
+    results = {}
+    for code in (iso4217.codes[0], iso4217.codes[-1], '???'):
+        results['is_cu(%r)' % code] = measure(
+            lambda: validator.is_cu(code), number)
+        results['%r in iso4217.codes' % code] = measure(
+            lambda: code in iso4217.codes, number)
+    return results
+
+
+def _is_cid_uuid(value):
+    '''The former `validator.is_cid`, parsing every value twice.'''
+    try:
+        u = uuid.UUID(value)
+    except Exception:
+        return False
+    else:
+        if bool(validator.cid_regex.match(value)):
+            return u.version == 4
+        else:
+            return False
+
+
+# The former validators of 'uip', 'dl', 'dr' and 'dh', which matched regular
+# expressions before checking the length of values.
+_former_ipv4_regex = re.compile(r'^(25[0-5]|2[0-4]\d|[0-1]?\d?\d)(\.(25[0-5]|2[0-4]\d|[0-1]?\d?\d)){3}$')
+_former_ipv6_regex = re.compile(r'^(((?=.*(::))(?!.*\3.+\3))\3?|[\dA-F]{1,4}:)([\dA-F]{1,4}(\3|:\b)|\2){5}(([\dA-F]{1,4}(\3|:\b|$)|\2){2}|(((2[0-4]|1\d|[1-9])?\d|25[0-5])\.?\b){4})\Z', re.IGNORECASE)
+_former_url_regex = re.compile(
+    r'^(?:[a-z0-9\.\-]*)://'
+    r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}(?<!-)\.?)|'
+    r'localhost|'
+    r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}|'
+    r'\[?[A-F0-9]*:[A-F0-9:]+\]?)'
+    r'(?::\d+)?'
+    r'(?:/?|[/?]\S+)$', re.IGNORECASE)
+
+
+def _former_is_uip(value):
+    return (bool(_former_ipv4_regex.match(value)) or
+            bool(_former_ipv6_regex.match(value)))
+
+
+def _former_is_dl(value):
+    return bool(_former_url_regex.match(value)) and len(value) <= 2048
+
+
+@benchmark
+def hostile_values(scale=1.0):
+    # Values a client controls, as long as fits in a hit and far longer.
+    number = _times(100, scale)
+    # Values within the length limits reach the scanners, longer ones only
+    # show that they are rejected up front.
+    values = {
+        'uip': [('2607:f0d0:1002:51::4', 'address'),
+                ('1:' * 19 + '11.2.3.', '45 chars of fields'),
+                ('::' + '1:' * 21 + 'x', '45 chars of colons'),
+                ('::' + '1:' * 4000, '8 KB of colons'),
+                ('::' + '1:' * 500000, '1 MB of colons')],
+        'dl': [(SAMPLES['dl'], 'URL'),
+               ('http://' + 'a.' * 500 + 'a-' * 520 + '-', '2 KB of labels'),
+               ('http://[' + '1:' * 1019 + 'x', '2 KB of colons'),
+               ('http://' + 'a.' * 1000 + 'a-' * 1000 + '-', '4 KB of labels'),
+               ('http://' + 'a.' * 100000 + 'a-' * 100000 + '-',
+                '400 KB of labels')],
+    }
+    results = {}
+    for param, former, current in (
+            ('uip', _former_is_uip, validator.is_uip),
+            ('dl', _former_is_dl, validator.is_dl)):
+        for value, name in values[param]:
+            results['former is_%s(%s)' % (param, name)] = measure(
+                lambda: former(value), number)
+            results['is_%s(%s)' % (param, name)] = measure(
+                lambda: current(value), number)
+    return results
+
+
+@benchmark
+def client_id_validator(scale=1.0):
+    # Hits of a thousand sessions, each repeating its client ID.
+    sessions = [str(uuid.uuid4()) for _ in range(1000)]
+    cids = [sessions[i % len(sessions)]
+            for i in range(_times(1000000, scale))]
+    results = {
+        'is_cid with uuid.UUID': measure_each(_is_cid_uuid, cids),
+        'is_cid': measure_each(validator.is_cid, cids),
+    }
+    validator.enable_cid_cache(len(sessions) * 2)
+    try:
+        results['is_cid with cache'] = measure_each(validator.is_cid, cids)
+    finally:
+        validator.enable_cid_cache(None)
+    return results
+
+
+@benchmark
+def enhanced_ecommerce(scale=1.0):
+    from prices import Price
+    number = _times(100, scale)
+    transaction = _transaction(100)
+    action = ProductAction(
+        PageView('/checkout/'), 'purchase',
+        [Product('SKU%04d' % i, 'item-%04d' % i, category='category',
+                 price=Price(10, currency='USD'), quantity=2)
+         for i in range(100)],
+        transaction_id='trans-01', revenue=transaction.get_total())
+    results = {}
+    for name, requestable in (('Transaction', transaction),
+                              ('ProductAction', action)):
+        results['encoded_payloads(%s with 100 products)' % name] = measure(
+            lambda: list(encoded_payloads('UA-123456-1', CLIENT_ID,
+                                          requestable)), number)
+    return results
+
+
+def _pairwise_total(transaction):
+    '''The former `Transaction.get_total`, adding prices one by one.'''
+    prices = [i.get_subtotal() for i in transaction.items]
+    total = sum(prices[1:], prices[0])
+    if transaction.shipping:
+        total += transaction.shipping
+    return total
+
+
+@benchmark
+def memoized_validators(scale=1.0):
+    # A site sending the same few hundred pages over and over.
+    pages = ['http://www.example.com/products/%d?color=blue' % i
+             for i in range(500)]
+    values = [pages[i % len(pages)] for i in range(_times(100000, scale))]
+    results = {'is_dl': measure_each(validator.is_dl, values)}
+    validator.enable_memoization(len(pages) * 2)
+    try:
+        results['is_dl memoized'] = measure_each(validator.is_dl, values)
+    finally:
+        validator.enable_memoization(None)
+    return results
+
+
+@benchmark
+def transaction_total(scale=1.0):
+    results = {}
+    for count in (10, 100, 1000):
+        transaction = _transaction(count)
+        number = _times(10000 // count, scale)
+        results['pairwise total of %d items' % count] = measure(
+            lambda: _pairwise_total(transaction), number)
+        results['sum_prices() of %d items' % count] = measure(
+            lambda: sum_prices([i.unit_price for i in transaction.items],
+                               [i.quantity for i in transaction.items]),
+            number)
+    return results
+
+
+@benchmark
+def hooks(scale=1.0):
+    number = _times(1000, scale)
+    transaction = _transaction(10)
+    results = {}
+    for name, installed in (('no hooks', None), ('Metrics', Metrics())):
+        set_hooks(installed)
+        try:
+            results['encoded_payloads(Transaction with 10 items), %s' % name] = (
+                measure(lambda: list(encoded_payloads(
+                    'UA-123456-1', CLIENT_ID, transaction)), number))
+        finally:
+            set_hooks(None)
+    return results
+
+
+@benchmark
+def deduplication(scale=1.0):
+    from .dedup import BloomDeduplicator, Deduplicator
+    from .transport import FakeTransport
+    number = _times(1000, scale)
+    transaction = _transaction(10)
+    # A new client ID per report, so that no hit is a duplicate.
+    client_ids = itertools.count()
+    results = {}
+    for name, dedup in (('none', None), ('Deduplicator', Deduplicator()),
+                        ('BloomDeduplicator', BloomDeduplicator())):
+        transport = FakeTransport()
+        results['report_async(Transaction with 10 items), dedup=%s' % name] = (
+            measure(lambda: report_async(
+                'UA-123456-1', 'client-%d' % next(client_ids), transaction,
+                batch=True, transport=transport, dedup=dedup), number))
+    return results
+
+
+@benchmark
+def fan_out(scale=1.0):
+    number = _times(1000, scale)
+    transaction = _transaction(10)
+    tracking_ids = ['UA-123456-1', 'UA-123456-2']
+    return {
+        'encoded_payloads(Transaction with 10 items) per property': measure(
+            lambda: [list(encoded_payloads(tracking_id, CLIENT_ID,
+                                           transaction))
+                     for tracking_id in tracking_ids], number),
+        'encoded_payloads(Transaction with 10 items) for 2 properties': (
+            measure(lambda: list(encoded_payloads(
+                tracking_ids, CLIENT_ID, transaction)), number)),
+    }
+
+
+@benchmark
+def replay(scale=1.0):
+    from .replay import Recorder, Replayer
+    from .transport import FakeTransport
+    count = _times(10000, scale)
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'hits')
+        recorder = Recorder(path)
+        (hit, _), = encoded_payloads('UA-123456-1', CLIENT_ID,
+                                     PageView('/my-page/', title='My Page'))
+        for _ in range(count):
+            recorder.record(TRACKING_URI, hit)
+        batched = os.path.join(directory, 'batches')
+        batch_recorder = Recorder(batched)
+        for _ in range(count // 20):
+            batch_recorder.record(BATCH_URI, '\n'.join([hit] * 20))
+        return {
+            'Replayer.replay() per hit': measure(
+                lambda: list(Replayer(path, FakeTransport()).replay()),
+                1) / count,
+            'Replayer.replay(stamp=False) per hit': measure(
+                lambda: list(Replayer(path, FakeTransport(),
+                                      stamp=False).replay()), 1) / count,
+            'Replayer.replay(stamp=False) per hit, recorded batches': measure(
+                lambda: list(Replayer(batched, FakeTransport(),
+                                      stamp=False).replay()),
+                1) / (count // 20 * 20),
+        }
+    finally:
+        shutil.rmtree(directory)
+
+
+_IMPORT_TIME = '''
+import time
+started = time.time()
+%s
+print((time.time() - started) * 1e6)
+'''
+
+
+@benchmark
+def import_time(scale=1.0):
+    # Each import runs in a new process, as a new App Engine instance would.
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    results = {}
+    for statement in (
+            'import google_measurement_protocol',
+            'import google_measurement_protocol.validator',
+            'from google_measurement_protocol import PageView, payloads\n'
+            'list(payloads("UA-123456-1", "CID", PageView("/")))',
+            'import google_measurement_protocol.tasklets'):
+        times = [float(subprocess.check_output(
+                     [sys.executable, '-c', _IMPORT_TIME % statement],
+                     env=env))
+                 for _ in range(_times(5, scale))]
+        results[statement.replace('\n', '; ')] = min(times)
+    return results
+
+
+def _install_urlfetch_stub():
+    from google.appengine.api import apiproxy_stub_map
+    from google.appengine.api import urlfetch_stub
+
+    def retrieve_url(url, payload, method, headers, request, response,
+                     *args, **kwargs):
+        response.set_statuscode(200)
+        response.set_content('')
+
+    apiproxy_stub_map.apiproxy = apiproxy_stub_map.APIProxyStubMap()
+    stub = urlfetch_stub.URLFetchServiceStub()
+    stub._RetrieveURL = retrieve_url
+    apiproxy_stub_map.apiproxy.RegisterStub('urlfetch', stub)
+
+
+@benchmark
+def dispatch(scale=1.0):
+    _install_urlfetch_stub()
+    number = _times(20, scale)
+    transaction = _transaction(30)
+    results = {}
+    for batch in (False, True):
+        def run():
+            for future in report_async('UA-123456-1', CLIENT_ID, transaction,
+                                       batch=batch):
+                future.get_result()
+        results['report_async(Transaction with 30 items, batch=%s)' % batch] = (
+            measure(run, number))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m google_measurement_protocol.benchmarks',
+        description=__doc__.strip().splitlines()[0])
+    parser.add_argument('names', nargs='*', metavar='benchmark',
+                        help='benchmarks to run, all by default: %s' % ', '.join(
+                            bench.__name__ for bench in BENCHMARKS))
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiply the number of iterations')
+    parser.add_argument('--json', metavar='FILE',
+                        help='save the results to FILE')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare with results saved in FILE')
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    results = {}
+    for bench in BENCHMARKS:
+        if args.names and bench.__name__ not in args.names:
+            continue
+        results[bench.__name__] = cases = bench(args.scale)
+        previous = baseline.get(bench.__name__, {})
+        for name, usec in sorted(cases.items()):
+            line = '%-60s %10.3f usec' % (name, usec)
+            if name in previous:
+                line += '  %6.2fx' % (previous[name] / usec)
+            print(line)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'time': time.time(),
+                       'scale': args.scale,
+                       'results': results}, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
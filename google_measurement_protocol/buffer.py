@@ -0,0 +1,136 @@
+import collections
+import threading
+import time
+
+from . import (BATCH_MAX_BYTES, BATCH_MAX_HITS, BATCH_URI,
+               QUEUED_HIT_MAX_BYTES, _request, batches, encoded_payloads,
+               stamp_queue_time)
+
+DROP_OLDEST = 'drop-oldest'
+BLOCK = 'block'
+REJECT = 'reject'
+
+
+class BufferFull(Exception):
+    """Raised when a hit is added to a full `HitBuffer` using `REJECT`."""
+    pass
+
+
+class HitBuffer(object):
+    """Accumulate hits and send them to the `/batch` endpoint.
+
+    Buffered hits are flushed once there are `flush_hits` of them, once they
+    add up to `flush_bytes` bytes or once the oldest one is older than
+    `max_age` seconds. Thresholds are checked whenever a hit is added, so call
+    `flush()` at the end of a request to send what is left.
+
+    At most `capacity` hits are kept buffered or in flight. When a hit is
+    added beyond that, `policy` decides what happens: `DROP_OLDEST` discards
+    the oldest buffered hit, `BLOCK` waits for the pending requests to finish
+    and `REJECT` raises `BufferFull`.
+
+    Hits are sent with the time they spent buffered as queue time; those
+    buffered for too long are counted in `expired` and discarded. Hits of
+    requests failing with an exception or a status of 400 and above are
+    counted in `failed`.
+    """
+
+    def __init__(self, capacity=1000, flush_hits=BATCH_MAX_HITS,
+                 flush_bytes=BATCH_MAX_BYTES, max_age=10, policy=DROP_OLDEST,
+                 deadline=None, transport=None):
+        if policy not in (DROP_OLDEST, BLOCK, REJECT):
+            raise ValueError('Unknown policy: %r' % (policy,))
+        self.capacity = capacity
+        self.flush_hits = flush_hits
+        self.flush_bytes = flush_bytes
+        self.max_age = max_age
+        self.policy = policy
+        self.deadline = deadline
+        self.transport = transport
+        self.dropped = 0
+        self.failed = 0
+        self.expired = 0
+        self._hits = collections.deque()
+        self._size = 0
+        self._in_flight = []
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._hits)
+
+    def add(self, tracking_id, client_id, requestable, extra_info=None,
+            extra_headers=None):
+        hits = []
+        for hit, headers in encoded_payloads(
+                tracking_id, client_id, requestable, extra_info,
+                extra_headers):
+            if len(hit) > QUEUED_HIT_MAX_BYTES:
+                raise ValueError('Hit exceeds %d bytes' % QUEUED_HIT_MAX_BYTES)
+            hits.append((hit, headers))
+        for hit, headers in hits:
+            self._put(hit, headers)
+
+    def flush(self):
+        """Send all buffered hits without waiting for the responses."""
+        with self._lock:
+            groups = collections.OrderedDict()
+            now = time.time()
+            while self._hits:
+                hit, headers, enqueued = self._hits.popleft()
+                hit = stamp_queue_time(hit, enqueued, now)
+                if hit is None:
+                    self.expired += 1
+                    continue
+                key = tuple(sorted(headers.iteritems())) if headers else ()
+                groups.setdefault(key, (headers, []))[1].append(hit)
+            self._size = 0
+            if not groups:
+                return
+            for headers, hits in groups.itervalues():
+                for body in batches(hits):
+                    future = _request(self.transport, body, headers,
+                                      self.deadline, uri=BATCH_URI)
+                    self._in_flight.append((future, body.count('\n') + 1))
+
+    def wait(self):
+        """Wait for all requests started by `flush()` to finish."""
+        with self._lock:
+            for future, _ in self._in_flight:
+                future.wait()
+            self._reap()
+
+    def _put(self, hit, headers):
+        with self._lock:
+            if self._pending() >= self.capacity:
+                if self.policy == REJECT:
+                    raise BufferFull()
+                if self.policy == BLOCK:
+                    self.flush()
+                    self.wait()
+                elif self._hits:
+                    old_hit = self._hits.popleft()[0]
+                    self._size -= len(old_hit)
+                    self.dropped += 1
+                else:
+                    self.dropped += 1
+                    return
+            self._hits.append((hit, headers, time.time()))
+            self._size += len(hit)
+            if (len(self._hits) >= self.flush_hits or
+                    self._size >= self.flush_bytes or
+                    time.time() - self._hits[0][2] >= self.max_age):
+                self.flush()
+
+    def _pending(self):
+        self._reap()
+        return len(self._hits) + sum(count for _, count in self._in_flight)
+
+    def _reap(self):
+        in_flight = []
+        for future, count in self._in_flight:
+            if not future.done():
+                in_flight.append((future, count))
+            elif (future.get_exception() is not None or
+                  future.get_result().status_code >= 400):
+                self.failed += count
+        self._in_flight = in_flight
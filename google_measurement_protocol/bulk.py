@@ -0,0 +1,216 @@
+"""
+Stream hits from CSV or JSON lines files, for backfills.
+
+Records are read one line at a time, turned into requestables, validated,
+grouped into batches and sent in order. After each batch the byte offset of
+the last record it completes is saved to a checkpoint file, so an
+interrupted import resumes where it stopped.
+"""
+from __future__ import print_function
+
+import argparse
+import csv
+import json
+import os
+import sys
+
+from . import (BATCH_URI, HIT_MAX_BYTES, Event, Item, PageView, Transaction,
+               VALIDATE_DROP, VALIDATE_OFF, ValidationStats, _request,
+               batches, encoded_payloads)
+
+FORMATS = ('csv', 'jsonl')
+
+
+class ImportStats(ValidationStats):
+    """Counters of an import, on top of those of validation."""
+
+    def __init__(self):
+        super(ImportStats, self).__init__()
+        self.records = 0
+        self.skipped = 0
+        self.requests = 0
+        self.sent = 0
+        self.offset = 0
+
+
+def read_records(f, format='jsonl', offset=0):
+    """Generate (record, offset) pairs from file `f`, starting at `offset`.
+
+    `offset` is that of the end of the record. Records are dicts; CSV files
+    start with a header row and hold one record per line.
+    """
+    if format not in FORMATS:
+        raise ValueError('Unknown format: %r' % (format,))
+    if format == 'csv':
+        f.seek(0)
+        header = next(csv.reader([f.readline()]))
+        offset = max(offset, f.tell())
+    f.seek(offset)
+    # Iterating over a file reads ahead, which would break tell().
+    for line in iter(f.readline, ''):
+        offset = f.tell()
+        if not line.strip():
+            continue
+        if format == 'csv':
+            record = dict(zip(header, next(csv.reader([line]))))
+        else:
+            record = json.loads(line)
+        yield record, offset
+
+
+def _fields(record, names):
+    return dict((name, record[name]) for name in names
+                if record.get(name) not in (None, ''))
+
+
+def _price(amount, currency):
+    from prices import Price
+    return Price(str(amount), currency=currency)
+
+
+def to_requestable(record):
+    """Return the requestable described by `record`.
+
+    `type` is 'pageview', 'event' or 'transaction', and other keys are the
+    arguments of the matching class. A transaction's `items` are a list of
+    records, or its JSON encoding in CSV files, with prices in `currency`.
+    """
+    hit_type = record.get('type')
+    if hit_type == 'pageview':
+        return PageView(**_fields(record, PageView._fields))
+    if hit_type == 'event':
+        return Event(**_fields(record, Event._fields))
+    if hit_type == 'transaction':
+        currency = record['currency']
+        items = record['items']
+        if isinstance(items, basestring):
+            items = json.loads(items)
+        fields = _fields(record, ('transaction_id', 'revenue', 'shipping',
+                                  'affiliation'))
+        for name in ('revenue', 'shipping'):
+            if name in fields:
+                fields[name] = _price(fields[name], currency)
+        fields['items'] = [
+            Item(unit_price=_price(item['price'], currency),
+                 **_fields(item, ('name', 'quantity', 'item_id', 'category')))
+            for item in items]
+        return Transaction(**fields)
+    raise ValueError('Unknown hit type: %r' % (hit_type,))
+
+
+def _encoded(records, tracking_id, validate, stats):
+    """Generate (hit, None) pairs, then (None, offset) once per record."""
+    for record, offset in records:
+        stats.records += 1
+        hits = list(encoded_payloads(
+            tracking_id, record['client_id'], to_requestable(record),
+            validate=validate, validation_stats=stats))
+        for hit, _ in hits:
+            if len(hit) > HIT_MAX_BYTES:
+                stats.skipped += 1
+                continue
+            yield hit, None
+        # Records without hits left still move the checkpoint forward.
+        yield None, offset
+
+
+def _batches(hits):
+    """Group (hit, offset) pairs into (body, offset) pairs with `batches()`.
+
+    The offset is that of the last record whose hits are all in the body or
+    earlier ones, `None` if there is none.
+    """
+    offsets = [None]
+
+    def only_hits():
+        for hit, end in hits:
+            if hit is None:
+                offsets[0] = end
+            else:
+                yield hit
+
+    offset = None
+    # batches() reads the hit following a body before generating it, so
+    # offsets of records completed by the body are known by then.
+    for body in batches(only_hits()):
+        offset = offsets[0]
+        yield body, offset
+    if offsets[0] != offset:
+        yield '', offsets[0]
+
+
+def read_checkpoint(path):
+    """Return the offset saved in `path`, 0 if there is none."""
+    try:
+        with open(path) as f:
+            return int(f.read().strip() or 0)
+    except IOError:
+        return 0
+
+
+def write_checkpoint(path, offset):
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as f:
+        f.write('%d\n' % offset)
+    os.rename(temporary, path)
+
+
+def import_hits(f, tracking_id, format='jsonl', transport=None,
+                validate=VALIDATE_DROP, checkpoint=None, extra_headers=None):
+    """Send the records of file `f` to Google Analytics in batches.
+
+    Resumes from the offset saved in `checkpoint`, a path, and saves it
+    after each batch. Hits larger than `HIT_MAX_BYTES` are skipped. Raises
+    `IOError` when a batch is rejected, leaving the checkpoint before it.
+    Returns `ImportStats`.
+    """
+    stats = ImportStats()
+    offset = read_checkpoint(checkpoint) if checkpoint else 0
+    records = read_records(f, format, offset)
+    for body, offset in _batches(_encoded(records, tracking_id, validate,
+                                          stats)):
+        if body:
+            response = _request(transport, body, extra_headers,
+                                uri=BATCH_URI).get_result()
+            if response.status_code >= 400:
+                raise IOError('Batch rejected with status %d' %
+                              response.status_code)
+            stats.requests += 1
+            stats.sent += body.count('\n') + 1
+        if offset is not None:
+            stats.offset = offset
+            if checkpoint:
+                write_checkpoint(checkpoint, offset)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='gmp-import', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('tracking_id')
+    parser.add_argument('file')
+    parser.add_argument('--format', choices=FORMATS,
+                        help='format of the file, from its extension by '
+                             'default')
+    parser.add_argument('--checkpoint', metavar='FILE',
+                        help='resume from and save the offset in FILE')
+    parser.add_argument('--no-validate', action='store_true',
+                        help='send invalid hits instead of dropping them')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='count hits without sending them')
+    args = parser.parse_args(argv)
+
+    from .transport import FakeTransport, HTTPTransport
+    transport = FakeTransport() if args.dry_run else HTTPTransport()
+    format = args.format or os.path.splitext(args.file)[1].lstrip('.')
+    validate = VALIDATE_OFF if args.no_validate else VALIDATE_DROP
+    with open(args.file, 'rb') as f:
+        stats = import_hits(f, args.tracking_id, format, transport, validate,
+                            args.checkpoint)
+    print('%d records, %d hits sent in %d requests, %d dropped, %d skipped' %
+          (stats.records, stats.sent, stats.requests, stats.dropped,
+           stats.skipped))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,181 @@
+import collections
+import hashlib
+import math
+import struct
+import threading
+import time
+
+# Parameters which differ between copies of the same hit.
+IGNORED_PARAMS = frozenset(['z', 'qt'])
+
+
+def fingerprint(hit, occurrence=0):
+    """Return a digest of a URL-encoded hit.
+
+    The digest does not depend on the order of parameters, nor on those in
+    `IGNORED_PARAMS`. `occurrence` tells identical hits of a single report
+    apart, counting from 0.
+    """
+    params = [param for param in hit.split('&')
+              if param.partition('=')[0] not in IGNORED_PARAMS]
+    params.sort()
+    digest = hashlib.sha1('&'.join(params))
+    if occurrence:
+        # URL-encoded hits hold no '#'.
+        digest.update('#%d' % occurrence)
+    return digest.digest()
+
+
+class Deduplicator(object):
+    """Drop hits already sent in the last `window` seconds.
+
+    Hits are claimed with `claim()` before being sent, then confirmed once
+    sent or released if sending failed, so that a failed report can be
+    retried. Fingerprints are kept in process, at most `max_entries` of
+    them, the oldest being forgotten first. Hits dropped are counted in
+    `duplicates`.
+    """
+
+    def __init__(self, window=300, max_entries=100000, clock=time.time):
+        self.window = window
+        self.max_entries = max_entries
+        self.clock = clock
+        self.duplicates = 0
+        self._seen = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, key):
+        """Remember `key`, returning whether it was not seen already."""
+        now = self.clock()
+        with self._lock:
+            seen = self._seen
+            while seen:
+                oldest, expires = next(seen.iteritems())
+                if expires > now and len(seen) < self.max_entries:
+                    break
+                del seen[oldest]
+            if key in seen:
+                return False
+            seen[key] = now + self.window
+            return True
+
+    def confirm(self, key):
+        """The hit of `key` was sent."""
+
+    def release(self, key):
+        """Forget `key`, the hit having failed to be sent."""
+        with self._lock:
+            self._seen.pop(key, None)
+
+    def claim(self, hit):
+        """Return the fingerprint of URL-encoded `hit`, `None` if a duplicate.
+
+        The fingerprint is to be passed to `confirm()` or `release()` once
+        the hit is sent or failed to be.
+        """
+        return self._claim(fingerprint(hit))
+
+    def claim_all(self, hits):
+        """Return the fingerprints of the hits of a report as `claim()`.
+
+        Identical hits of the report, such as two equal items of a
+        transaction, are not duplicates of each other; only those already
+        sent by another report are.
+        """
+        occurrences = collections.Counter()
+        keys = []
+        for hit in hits:
+            key = fingerprint(hit)
+            occurrence = occurrences[key]
+            occurrences[key] += 1
+            if occurrence:
+                key = fingerprint(hit, occurrence)
+            keys.append(self._claim(key))
+        return keys
+
+    def _claim(self, key):
+        if self.add(key):
+            return key
+        self.duplicates += 1
+        return None
+
+
+class BloomDeduplicator(Deduplicator):
+    """A `Deduplicator` keeping fingerprints in Bloom filters.
+
+    Memory stays bounded for large windows, at the cost of dropping a share
+    of about `error_rate` of new hits once `capacity` hits were sent in a
+    window. Filters are replaced once per `window`, so a hit is remembered
+    for one to two windows. Since nothing can be removed from a Bloom
+    filter, hits are only added to it once confirmed.
+    """
+
+    def __init__(self, window=3600, capacity=1000000, error_rate=0.001,
+                 clock=time.time):
+        super(BloomDeduplicator, self).__init__(window, clock=clock)
+        self.bits = int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(int(round(self.bits * math.log(2) / capacity)), 1)
+        self._current = bytearray((self.bits + 7) // 8)
+        self._previous = bytearray(len(self._current))
+        self._started = clock()
+        self._claimed = set()
+
+    def _positions(self, key):
+        first, second = struct.unpack('>QQ', key[:16])
+        return [(first + i * second) % self.bits for i in range(self.hashes)]
+
+    def _rotate(self):
+        now = self.clock()
+        if now - self._started >= self.window:
+            self._previous = self._current
+            self._current = bytearray(len(self._previous))
+            self._started = now
+
+    def add(self, key):
+        positions = self._positions(key)
+        with self._lock:
+            self._rotate()
+            current = self._current
+            previous = self._previous
+            if (key in self._claimed or
+                    all(current[p >> 3] & (1 << (p & 7)) for p in positions) or
+                    all(previous[p >> 3] & (1 << (p & 7))
+                        for p in positions)):
+                return False
+            self._claimed.add(key)
+            return True
+
+    def confirm(self, key):
+        positions = self._positions(key)
+        with self._lock:
+            self._rotate()
+            self._claimed.discard(key)
+            current = self._current
+            for p in positions:
+                current[p >> 3] |= 1 << (p & 7)
+
+    def release(self, key):
+        with self._lock:
+            self._claimed.discard(key)
+
+
+class MemcacheDeduplicator(Deduplicator):
+    """A `Deduplicator` sharing fingerprints between instances in memcache.
+
+    Fingerprints expire after `window` seconds, or sooner if memcache
+    evicts them.
+    """
+
+    def __init__(self, window=300, namespace='google-measurement-protocol'):
+        super(MemcacheDeduplicator, self).__init__(window)
+        self.namespace = namespace
+
+    def add(self, key):
+        from google.appengine.api import memcache
+        return memcache.add(key.encode('hex'), 1, time=self.window,
+                            namespace=self.namespace)
+
+    def release(self, key):
+        from google.appengine.api import memcache
+        memcache.delete(key.encode('hex'), namespace=self.namespace)
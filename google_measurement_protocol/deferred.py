@@ -0,0 +1,168 @@
+import collections
+import itertools
+import json
+import logging
+import threading
+import time
+
+from . import (BATCH_URI, QUEUED_HIT_MAX_BYTES, _default_transport,
+               _request, batches, encoded_payloads, stamp_queue_time)
+
+
+class PullQueue(object):
+    """Task storage backed by an App Engine pull queue."""
+
+    def __init__(self, name='pull-queue'):
+        from google.appengine.api import taskqueue
+        self.queue = taskqueue.Queue(name)
+
+    def add(self, payload):
+        from google.appengine.api import taskqueue
+        self.queue.add(taskqueue.Task(payload=payload, method='PULL'))
+
+    def lease(self, lease_seconds, max_tasks):
+        return self.queue.lease_tasks(lease_seconds, max_tasks)
+
+    def delete(self, tasks):
+        if tasks:
+            self.queue.delete_tasks(tasks)
+
+
+_LocalTask = collections.namedtuple('_LocalTask', 'name payload')
+
+
+class LocalQueue(object):
+    """In-memory stand-in for `PullQueue`, for tests and local development.
+
+    Leased tasks become available again once their lease expires unless they
+    are deleted first.
+    """
+
+    def __init__(self):
+        self._tasks = collections.OrderedDict()
+        self._names = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def add(self, payload):
+        with self._lock:
+            self._tasks[next(self._names)] = [payload, 0]
+
+    def lease(self, lease_seconds, max_tasks):
+        now = time.time()
+        leased = []
+        with self._lock:
+            for name, task in self._tasks.iteritems():
+                if len(leased) >= max_tasks:
+                    break
+                if task[1] <= now:
+                    task[1] = now + lease_seconds
+                    leased.append(_LocalTask(name, task[0]))
+        return leased
+
+    def delete(self, tasks):
+        with self._lock:
+            for task in tasks:
+                self._tasks.pop(task.name, None)
+
+
+def _retryable(status_code):
+    """Return whether a request answered with `status_code` may succeed."""
+    return status_code == 429 or status_code >= 500
+
+
+class DeferredReporter(object):
+    """Report measurements from a worker instead of the current request.
+
+    `report()` stores all hits of a requestable as a single task. `process()`,
+    meant to be called from a cron job or backend, leases tasks in bulk,
+    sends their hits to the `/batch` endpoint and deletes the tasks that were
+    delivered. Tasks with hits that failed, with an exception or a status of
+    429 or 500 and above, are retried once their lease expires. Hits rejected
+    with another status are not retried and counted in `dropped`.
+
+    Hits are sent with the time since `report()` as queue time. Those queued
+    for too long are counted in `expired` and discarded.
+    """
+
+    def __init__(self, queue=None, lease_seconds=60, max_tasks=1000,
+                 transport=None):
+        if queue is None:
+            queue = PullQueue()
+        if transport is None:
+            transport = _default_transport
+        self.queue = queue
+        self.transport = transport
+        self.lease_seconds = lease_seconds
+        self.max_tasks = max_tasks
+        self.expired = 0
+        self.dropped = 0
+
+    def report(self, tracking_id, client_id, requestable, extra_info=None,
+               extra_headers=None):
+        hits = []
+        for hit, _ in encoded_payloads(tracking_id, client_id, requestable,
+                                       extra_info, extra_headers):
+            if len(hit) > QUEUED_HIT_MAX_BYTES:
+                raise ValueError('Hit exceeds %d bytes' % QUEUED_HIT_MAX_BYTES)
+            hits.append(hit)
+        self.queue.add(json.dumps({'headers': extra_headers or {},
+                                   'hits': hits,
+                                   'time': time.time()}))
+
+    def process(self, deadline=None):
+        """Lease a round of tasks and send their hits.
+
+        Returns the number of hits delivered.
+        """
+        tasks = self.queue.lease(self.lease_seconds, self.max_tasks)
+        if not tasks:
+            return 0
+
+        groups = {}
+        now = time.time()
+        for index, task in enumerate(tasks):
+            record = json.loads(task.payload)
+            key = json.dumps(record['headers'], sort_keys=True)
+            headers, entries = groups.setdefault(key, (record['headers'], []))
+            for hit in record['hits']:
+                hit = stamp_queue_time(str(hit), record['time'], now)
+                if hit is None:
+                    self.expired += 1
+                else:
+                    entries.append((hit, index))
+
+        rpcs = []
+        for headers, entries in groups.itervalues():
+            start = 0
+            for body in batches([hit for hit, _ in entries]):
+                end = start + body.count('\n') + 1
+                owners = set(index for _, index in entries[start:end])
+                rpcs.append((_request(self.transport, body, headers, deadline,
+                                      uri=BATCH_URI), owners, end - start))
+                start = end
+
+        failed = set()
+        sent = 0
+        for future, owners, count in rpcs:
+            try:
+                response = future.get_result()
+            except self.transport.errors:
+                logging.warning('Failed to send %d hits', count, exc_info=True)
+                failed.update(owners)
+                continue
+            if _retryable(response.status_code):
+                logging.warning('Failed to send %d hits: HTTP %d', count,
+                                response.status_code)
+                failed.update(owners)
+            elif response.status_code >= 400:
+                logging.warning('Dropped %d hits: HTTP %d', count,
+                                response.status_code)
+                self.dropped += count
+            else:
+                sent += count
+        self.queue.delete([task for index, task in enumerate(tasks)
+                           if index not in failed])
+        return sent
@@ -0,0 +1,94 @@
+from collections import Counter, deque
+import threading
+
+
+class Hooks(object):
+    """Callbacks fired while reporting, installed with `set_hooks()`.
+
+    Durations are in seconds. Methods do nothing by default, so subclasses
+    only override the events they need. They are called from the reporting
+    code path and should return quickly.
+    """
+
+    def payload_built(self, seconds):
+        """A hit was built from a requestable."""
+
+    def payload_encoded(self, seconds):
+        """A hit was URL-encoded."""
+
+    def hit_dropped(self, reason):
+        """A hit was left out.
+
+        `reason` is 'invalid', 'sampled', 'limited' or 'duplicate'.
+        """
+
+    def request_sent(self, uri, body):
+        """A request was handed to the transport."""
+
+    def request_completed(self, uri, body, seconds, response=None,
+                          exception=None):
+        """A request finished with either `response` or `exception`."""
+
+
+class Histogram(object):
+    """The last `size` samples of a measurement, for percentiles."""
+
+    def __init__(self, size=10000):
+        self.count = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=size)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.samples.append(value)
+
+    def percentile(self, p):
+        """Return the `p`th percentile of the samples, `None` if empty."""
+        if not self.samples:
+            return None
+        samples = sorted(self.samples)
+        index = int(round(p / 100.0 * (len(samples) - 1)))
+        return samples[index]
+
+
+class Metrics(Hooks):
+    """Hooks counting hits and requests and sampling their latencies.
+
+    `counters` holds 'hits', 'requests', 'hits_sent', 'succeeded' and
+    'failed' plus 'dropped_<reason>' counts. `build`, `encode` and
+    `request` are `Histogram`s of durations. A request fails with an
+    exception or an HTTP status of 400 or more.
+    """
+
+    def __init__(self, size=10000):
+        self.counters = Counter()
+        self.build = Histogram(size)
+        self.encode = Histogram(size)
+        self.request = Histogram(size)
+        self._lock = threading.Lock()
+
+    def payload_built(self, seconds):
+        with self._lock:
+            self.counters['hits'] += 1
+            self.build.add(seconds)
+
+    def payload_encoded(self, seconds):
+        with self._lock:
+            self.encode.add(seconds)
+
+    def hit_dropped(self, reason):
+        with self._lock:
+            self.counters['dropped_' + reason] += 1
+
+    def request_sent(self, uri, body):
+        with self._lock:
+            self.counters['requests'] += 1
+            self.counters['hits_sent'] += body.count('\n') + 1
+
+    def request_completed(self, uri, body, seconds, response=None,
+                          exception=None):
+        failed = exception is not None or response.status_code >= 400
+        with self._lock:
+            self.counters['failed' if failed else 'succeeded'] += 1
+            self.request.add(seconds)
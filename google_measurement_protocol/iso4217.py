@@ -1,185 +1,209 @@
 # -*- coding: utf-8 -*-
 # http://en.wikipedia.org/wiki/ISO_4217
 
-codes = (
-  "AED", # United Arab Emirates dirham
-  "AFN", # Afghan afghani
-  "ALL", # Albanian lek
-  "AMD", # Armenian dram
-  "ANG", # Netherlands Antillean guilder
-  "AOA", # Angolan kwanza
-  "ARS", # Argentine peso
-  "AUD", # Australian dollar
-  "AWG", # Aruban florin
-  "AZN", # Azerbaijani manat
-  "BAM", # Bosnia and Herzegovina convertible mark
-  "BBD", # Barbados dollar
-  "BDT", # Bangladeshi taka
-  "BGN", # Bulgarian lev
-  "BHD", # Bahraini dinar
-  "BIF", # Burundian franc
-  "BMD", # Bermudian dollar
-  "BND", # Brunei dollar
-  "BOB", # Boliviano
-  "BOV", # Bolivian Mvdol (funds code)
-  "BRL", # Brazilian real
-  "BSD", # Bahamian dollar
-  "BTN", # Bhutanese ngultrum
-  "BWP", # Botswana pula
-  "BYR", # Belarusian ruble
-  "BZD", # Belize dollar
-  "CAD", # Canadian dollar
-  "CDF", # Congolese franc
-  "CHE", # WIR Euro (complementary currency)
-  "CHF", # Swiss franc
-  "CHW", # WIR Franc (complementary currency)
-  "CLF", # Unidad de Fomento (funds code)
-  "CLP", # Chilean peso
-  "CNY", # Chinese yuan
-  "COP", # Colombian peso
-  "COU", # Unidad de Valor Real (UVR) (funds code)[7]
-  "CRC", # Costa Rican colon
-  "CUC", # Cuban convertible peso
-  "CUP", # Cuban peso
-  "CVE", # Cape Verde escudo
-  "CZK", # Czech koruna
-  "DJF", # Djiboutian franc
-  "DKK", # Danish krone
-  "DOP", # Dominican peso
-  "DZD", # Algerian dinar
-  "EGP", # Egyptian pound
-  "ERN", # Eritrean nakfa
-  "ETB", # Ethiopian birr
-  "EUR", # Euro
-  "FJD", # Fiji dollar
-  "FKP", # Falkland Islands pound
-  "GBP", # Pound sterling
-  "GEL", # Georgian lari
-  "GHS", # Ghanaian cedi
-  "GIP", # Gibraltar pound
-  "GMD", # Gambian dalasi
-  "GNF", # Guinean franc
-  "GTQ", # Guatemalan quetzal
-  "GYD", # Guyanese dollar
-  "HKD", # Hong Kong dollar
-  "HNL", # Honduran lempira
-  "HRK", # Croatian kuna
-  "HTG", # Haitian gourde
-  "HUF", # Hungarian forint
-  "IDR", # Indonesian rupiah
-  "ILS", # Israeli new shekel
-  "INR", # Indian rupee
-  "IQD", # Iraqi dinar
-  "IRR", # Iranian rial
-  "ISK", # Icelandic króna
-  "JMD", # Jamaican dollar
-  "JOD", # Jordanian dinar
-  "JPY", # Japanese yen
-  "KES", # Kenyan shilling
-  "KGS", # Kyrgyzstani som
-  "KHR", # Cambodian riel
-  "KMF", # Comoro franc
-  "KPW", # North Korean won
-  "KRW", # South Korean won
-  "KWD", # Kuwaiti dinar
-  "KYD", # Cayman Islands dollar
-  "KZT", # Kazakhstani tenge
-  "LAK", # Lao kip
-  "LBP", # Lebanese pound
-  "LKR", # Sri Lankan rupee
-  "LRD", # Liberian dollar
-  "LSL", # Lesotho loti
-  "LTL", # Lithuanian litas
-  "LYD", # Libyan dinar
-  "MAD", # Moroccan dirham
-  "MDL", # Moldovan leu
-  "MGA", # Malagasy ariary
-  "MKD", # Macedonian denar
-  "MMK", # Myanma kyat
-  "MNT", # Mongolian tugrik
-  "MOP", # Macanese pataca
-  "MRO", # Mauritanian ouguiya
-  "MUR", # Mauritian rupee
-  "MVR", # Maldivian rufiyaa
-  "MWK", # Malawian kwacha
-  "MXN", # Mexican peso
-  "MXV", # Mexican Unidad de Inversion (UDI) (funds code)
-  "MYR", # Malaysian ringgit
-  "MZN", # Mozambican metical
-  "NAD", # Namibian dollar
-  "NGN", # Nigerian naira
-  "NIO", # Nicaraguan córdoba
-  "NOK", # Norwegian krone
-  "NPR", # Nepalese rupee
-  "NZD", # New Zealand dollar
-  "OMR", # Omani rial
-  "PAB", # Panamanian balboa
-  "PEN", # Peruvian nuevo sol
-  "PGK", # Papua New Guinean kina
-  "PHP", # Philippine peso
-  "PKR", # Pakistani rupee
-  "PLN", # Polish złoty
-  "PYG", # Paraguayan guaraní
-  "QAR", # Qatari riyal
-  "RON", # Romanian new leu
-  "RSD", # Serbian dinar
-  "RUB", # Russian ruble
-  "RWF", # Rwandan franc
-  "SAR", # Saudi riyal
-  "SBD", # Solomon Islands dollar
-  "SCR", # Seychelles rupee
-  "SDG", # Sudanese pound
-  "SEK", # Swedish krona/kronor
-  "SGD", # Singapore dollar
-  "SHP", # Saint Helena pound
-  "SLL", # Sierra Leonean leone
-  "SOS", # Somali shilling
-  "SRD", # Surinamese dollar
-  "SSP", # South Sudanese pound
-  "STD", # São Tomé and Príncipe dobra
-  "SYP", # Syrian pound
-  "SZL", # Swazi lilangeni
-  "THB", # Thai baht
-  "TJS", # Tajikistani somoni
-  "TMT", # Turkmenistani manat
-  "TND", # Tunisian dinar
-  "TOP", # Tongan paʻanga
-  "TRY", # Turkish lira
-  "TTD", # Trinidad and Tobago dollar
-  "TWD", # New Taiwan dollar
-  "TZS", # Tanzanian shilling
-  "UAH", # Ukrainian hryvnia
-  "UGX", # Ugandan shilling
-  "USD", # United States dollar
-  "USN", # United States dollar (next day) (funds code)
-  "USS", # United States dollar (same day) (funds code)[10]
-  "UYI", # Uruguay Peso en Unidades Indexadas (URUIURUI) (funds code)
-  "UYU", # Uruguayan peso
-  "UZS", # Uzbekistan som
-  "VEF" # Venezuelan boliívar
-  "VND", # Vietnamese dong
-  "VUV", # Vanuatu vatu
-  "WST", # Samoan tala
-  "XAF", # CFA franc BEAC
-  "XAG", # Silver (one troy ounce)
-  "XAU", # Gold (one troy ounce)
-  "XBA", # European Composite Unit (EURCO) (bond market unit)
-  "XBB", # European Monetary Unit (E.M.U.-6) (bond market unit)
-  "XBC", # European Unit of Account 9 (E.U.A.-9) (bond market unit)
-  "XBD", # European Unit of Account 17 (E.U.A.-17) (bond market unit)
-  "XCD", # East Caribbean dollar
-  "XDR", # Special drawing rights
-  "XFU", # UIC franc (special settlement currency)
-  "XOF", # CFA franc BCEAO
-  "XPD", # Palladium (one troy ounce)
-  "XPF", # CFP franc (franc Pacifique)
-  "XPT", # Platinum (one troy ounce)
-  "XSU", # SUCRE
-  "XTS", # Code reserved for testing purposes
-  "XUA", # ADB Unit of Account
-  "XXX", # No currency
-  "YER", # Yemeni rial
-  "ZAR", # South African rand
-  "ZMW", # Zambian kwacha
-  "ZWD", # Zimbabwe dollar
-)
+# Number of digits after the decimal separator per currency code, `None` for
+# codes that are not actual currencies.
+minor_units = {
+  "AED": 2, # United Arab Emirates dirham
+  "AFN": 2, # Afghan afghani
+  "ALL": 2, # Albanian lek
+  "AMD": 2, # Armenian dram
+  "ANG": 2, # Netherlands Antillean guilder
+  "AOA": 2, # Angolan kwanza
+  "ARS": 2, # Argentine peso
+  "AUD": 2, # Australian dollar
+  "AWG": 2, # Aruban florin
+  "AZN": 2, # Azerbaijani manat
+  "BAM": 2, # Bosnia and Herzegovina convertible mark
+  "BBD": 2, # Barbados dollar
+  "BDT": 2, # Bangladeshi taka
+  "BGN": 2, # Bulgarian lev
+  "BHD": 3, # Bahraini dinar
+  "BIF": 0, # Burundian franc
+  "BMD": 2, # Bermudian dollar
+  "BND": 2, # Brunei dollar
+  "BOB": 2, # Boliviano
+  "BOV": 2, # Bolivian Mvdol (funds code)
+  "BRL": 2, # Brazilian real
+  "BSD": 2, # Bahamian dollar
+  "BTN": 2, # Bhutanese ngultrum
+  "BWP": 2, # Botswana pula
+  "BYR": 0, # Belarusian ruble
+  "BZD": 2, # Belize dollar
+  "CAD": 2, # Canadian dollar
+  "CDF": 2, # Congolese franc
+  "CHE": 2, # WIR Euro (complementary currency)
+  "CHF": 2, # Swiss franc
+  "CHW": 2, # WIR Franc (complementary currency)
+  "CLF": 4, # Unidad de Fomento (funds code)
+  "CLP": 0, # Chilean peso
+  "CNY": 2, # Chinese yuan
+  "COP": 2, # Colombian peso
+  "COU": 2, # Unidad de Valor Real (UVR) (funds code)[7]
+  "CRC": 2, # Costa Rican colon
+  "CUC": 2, # Cuban convertible peso
+  "CUP": 2, # Cuban peso
+  "CVE": 2, # Cape Verde escudo
+  "CZK": 2, # Czech koruna
+  "DJF": 0, # Djiboutian franc
+  "DKK": 2, # Danish krone
+  "DOP": 2, # Dominican peso
+  "DZD": 2, # Algerian dinar
+  "EGP": 2, # Egyptian pound
+  "ERN": 2, # Eritrean nakfa
+  "ETB": 2, # Ethiopian birr
+  "EUR": 2, # Euro
+  "FJD": 2, # Fiji dollar
+  "FKP": 2, # Falkland Islands pound
+  "GBP": 2, # Pound sterling
+  "GEL": 2, # Georgian lari
+  "GHS": 2, # Ghanaian cedi
+  "GIP": 2, # Gibraltar pound
+  "GMD": 2, # Gambian dalasi
+  "GNF": 0, # Guinean franc
+  "GTQ": 2, # Guatemalan quetzal
+  "GYD": 2, # Guyanese dollar
+  "HKD": 2, # Hong Kong dollar
+  "HNL": 2, # Honduran lempira
+  "HRK": 2, # Croatian kuna
+  "HTG": 2, # Haitian gourde
+  "HUF": 2, # Hungarian forint
+  "IDR": 2, # Indonesian rupiah
+  "ILS": 2, # Israeli new shekel
+  "INR": 2, # Indian rupee
+  "IQD": 3, # Iraqi dinar
+  "IRR": 2, # Iranian rial
+  "ISK": 0, # Icelandic króna
+  "JMD": 2, # Jamaican dollar
+  "JOD": 3, # Jordanian dinar
+  "JPY": 0, # Japanese yen
+  "KES": 2, # Kenyan shilling
+  "KGS": 2, # Kyrgyzstani som
+  "KHR": 2, # Cambodian riel
+  "KMF": 0, # Comoro franc
+  "KPW": 2, # North Korean won
+  "KRW": 0, # South Korean won
+  "KWD": 3, # Kuwaiti dinar
+  "KYD": 2, # Cayman Islands dollar
+  "KZT": 2, # Kazakhstani tenge
+  "LAK": 2, # Lao kip
+  "LBP": 2, # Lebanese pound
+  "LKR": 2, # Sri Lankan rupee
+  "LRD": 2, # Liberian dollar
+  "LSL": 2, # Lesotho loti
+  "LTL": 2, # Lithuanian litas
+  "LYD": 3, # Libyan dinar
+  "MAD": 2, # Moroccan dirham
+  "MDL": 2, # Moldovan leu
+  "MGA": 2, # Malagasy ariary
+  "MKD": 2, # Macedonian denar
+  "MMK": 2, # Myanma kyat
+  "MNT": 2, # Mongolian tugrik
+  "MOP": 2, # Macanese pataca
+  "MRO": 2, # Mauritanian ouguiya
+  "MUR": 2, # Mauritian rupee
+  "MVR": 2, # Maldivian rufiyaa
+  "MWK": 2, # Malawian kwacha
+  "MXN": 2, # Mexican peso
+  "MXV": 2, # Mexican Unidad de Inversion (UDI) (funds code)
+  "MYR": 2, # Malaysian ringgit
+  "MZN": 2, # Mozambican metical
+  "NAD": 2, # Namibian dollar
+  "NGN": 2, # Nigerian naira
+  "NIO": 2, # Nicaraguan córdoba
+  "NOK": 2, # Norwegian krone
+  "NPR": 2, # Nepalese rupee
+  "NZD": 2, # New Zealand dollar
+  "OMR": 3, # Omani rial
+  "PAB": 2, # Panamanian balboa
+  "PEN": 2, # Peruvian nuevo sol
+  "PGK": 2, # Papua New Guinean kina
+  "PHP": 2, # Philippine peso
+  "PKR": 2, # Pakistani rupee
+  "PLN": 2, # Polish złoty
+  "PYG": 0, # Paraguayan guaraní
+  "QAR": 2, # Qatari riyal
+  "RON": 2, # Romanian new leu
+  "RSD": 2, # Serbian dinar
+  "RUB": 2, # Russian ruble
+  "RWF": 0, # Rwandan franc
+  "SAR": 2, # Saudi riyal
+  "SBD": 2, # Solomon Islands dollar
+  "SCR": 2, # Seychelles rupee
+  "SDG": 2, # Sudanese pound
+  "SEK": 2, # Swedish krona/kronor
+  "SGD": 2, # Singapore dollar
+  "SHP": 2, # Saint Helena pound
+  "SLL": 2, # Sierra Leonean leone
+  "SOS": 2, # Somali shilling
+  "SRD": 2, # Surinamese dollar
+  "SSP": 2, # South Sudanese pound
+  "STD": 2, # São Tomé and Príncipe dobra
+  "SYP": 2, # Syrian pound
+  "SZL": 2, # Swazi lilangeni
+  "THB": 2, # Thai baht
+  "TJS": 2, # Tajikistani somoni
+  "TMT": 2, # Turkmenistani manat
+  "TND": 3, # Tunisian dinar
+  "TOP": 2, # Tongan paʻanga
+  "TRY": 2, # Turkish lira
+  "TTD": 2, # Trinidad and Tobago dollar
+  "TWD": 2, # New Taiwan dollar
+  "TZS": 2, # Tanzanian shilling
+  "UAH": 2, # Ukrainian hryvnia
+  "UGX": 0, # Ugandan shilling
+  "USD": 2, # United States dollar
+  "USN": 2, # United States dollar (next day) (funds code)
+  "USS": 2, # United States dollar (same day) (funds code)[10]
+  "UYI": 0, # Uruguay Peso en Unidades Indexadas (URUIURUI) (funds code)
+  "UYU": 2, # Uruguayan peso
+  "UZS": 2, # Uzbekistan som
+  "VEF": 2, # Venezuelan boliívar
+  "VND": 0, # Vietnamese dong
+  "VUV": 0, # Vanuatu vatu
+  "WST": 2, # Samoan tala
+  "XAF": 0, # CFA franc BEAC
+  "XAG": None, # Silver (one troy ounce)
+  "XAU": None, # Gold (one troy ounce)
+  "XBA": None, # European Composite Unit (EURCO) (bond market unit)
+  "XBB": None, # European Monetary Unit (E.M.U.-6) (bond market unit)
+  "XBC": None, # European Unit of Account 9 (E.U.A.-9) (bond market unit)
+  "XBD": None, # European Unit of Account 17 (E.U.A.-17) (bond market unit)
+  "XCD": 2, # East Caribbean dollar
+  "XDR": None, # Special drawing rights
+  "XFU": None, # UIC franc (special settlement currency)
+  "XOF": 0, # CFA franc BCEAO
+  "XPD": None, # Palladium (one troy ounce)
+  "XPF": 0, # CFP franc (franc Pacifique)
+  "XPT": None, # Platinum (one troy ounce)
+  "XSU": None, # SUCRE
+  "XTS": None, # Code reserved for testing purposes
+  "XUA": None, # ADB Unit of Account
+  "XXX": None, # No currency
+  "YER": 2, # Yemeni rial
+  "ZAR": 2, # South African rand
+  "ZMW": 2, # Zambian kwacha
+  "ZWD": 2, # Zimbabwe dollar
+}
+
+codes = tuple(sorted(minor_units))
+
+
+def quantize(amount, code):
+    """
+    Round `amount` to the minor unit of currency `code`, for instance when
+    formatting 'tr' or 'ip' values.
+
+    >>> from decimal import Decimal
+    >>> quantize(Decimal("10"), "USD")
+    Decimal('10.00')
+    >>> quantize(Decimal("1.5"), "JPY")
+    Decimal('2')
+    >>> quantize(Decimal("1.5"), "XAU")
+    Decimal('1.5')
+    """
+    from decimal import Decimal
+    units = minor_units.get(code)
+    if units is None:
+        return amount
+    return Decimal(amount).quantize(Decimal(1).scaleb(-units))
@@ -0,0 +1,153 @@
+import collections
+import itertools
+import json
+import mmap
+import struct
+import threading
+import time
+
+from . import BATCH_URI, HIT_MAX_BYTES, _request, batches, stamp_queue_time
+from .transport import Response, Result, Transport
+
+# Each record is a header followed by the request headers, JSON-encoded or
+# empty if there are none, and the request body. The header holds whether the
+# body is a batch, the time it was recorded and both lengths.
+_HEADER = struct.Struct('>BdHI')
+
+
+class Recorder(Transport):
+    """Append the requests it is given to the file at `path`.
+
+    Use it as a transport to capture traffic, answering every request with
+    `status_code`, or pass its `dead_letter()` to `report()` to only keep
+    requests that failed.
+    """
+
+    def __init__(self, path, status_code=204):
+        self.path = path
+        self.status_code = status_code
+        self._lock = threading.Lock()
+
+    def record(self, uri, body, recorded=None, headers=None):
+        if recorded is None:
+            recorded = time.time()
+        headers = json.dumps(headers, sort_keys=True) if headers else ''
+        header = _HEADER.pack(uri == BATCH_URI, recorded, len(headers),
+                              len(body))
+        with self._lock:
+            with open(self.path, 'ab') as f:
+                f.write(header + headers + body)
+
+    def post(self, uri, body, headers, deadline=None):
+        self.record(uri, body, headers=headers)
+        return Result(Response(self.status_code, '', {}))
+
+    def dead_letter(self, uri, body, headers, error):
+        self.record(uri, body, headers=headers)
+
+
+class Replayer(object):
+    """Send the requests recorded by a `Recorder` in the file at `path`.
+
+    The file is memory-mapped. With `stamp` true, recorded hits are given
+    the time since they were recorded as queue time and grouped into new
+    batches, and those queued for too long are counted in `expired`.
+    Otherwise recorded batches are sent as they are, straight from the
+    file, and only hits recorded one by one are grouped into batches. Hits
+    are sent with the headers they were recorded with, only consecutive
+    records with the same headers sharing batches. Hits larger than
+    `HIT_MAX_BYTES` are counted in `skipped`. Up to `max_in_flight`
+    requests are sent at once.
+    """
+
+    def __init__(self, path, transport=None, stamp=True, max_in_flight=10,
+                 deadline=None):
+        self.path = path
+        self.transport = transport
+        self.stamp = stamp
+        self.max_in_flight = max_in_flight
+        self.deadline = deadline
+        self.expired = 0
+        self.skipped = 0
+
+    def records(self, data, offset=0):
+        """Generate (batch, recorded, headers, start, end) for each record.
+
+        `batch` tells whether the body `data[start:end]` is a batch, and
+        `headers` is the JSON encoding of its headers, empty if none.
+        """
+        size = len(data)
+        while offset + _HEADER.size <= size:
+            batch, recorded, headers_length, length = _HEADER.unpack_from(
+                data, offset)
+            start = offset + _HEADER.size + headers_length
+            offset = start + length
+            if offset > size:
+                # A record cut short by a crash while it was written.
+                break
+            headers = data[start - headers_length:start]
+            yield batch, recorded, headers, start, offset
+
+    def _bodies(self, data, now):
+        """Generate (body, headers) pairs of the requests to send."""
+        for headers, records in itertools.groupby(self.records(data),
+                                                  lambda record: record[2]):
+            headers = json.loads(headers) if headers else {}
+            if self.stamp:
+                bodies = batches(self._hits(data, records, now))
+            else:
+                bodies = self._recorded_batches(data, records)
+            for body in bodies:
+                yield body, headers
+
+    def _hits(self, data, records, now):
+        for batch, recorded, _, start, end in records:
+            body = data[start:end]
+            hits = body.split('\n') if batch else (body,)
+            for hit in hits:
+                hit = stamp_queue_time(hit, recorded, now)
+                if hit is None:
+                    self.expired += 1
+                    continue
+                if len(hit) > HIT_MAX_BYTES:
+                    self.skipped += 1
+                    continue
+                yield hit
+
+    def _recorded_batches(self, data, records):
+        for batch, records in itertools.groupby(records,
+                                                lambda record: record[0]):
+            if batch:
+                for _, _, _, start, end in records:
+                    yield data[start:end]
+            else:
+                for body in batches(self._single_hits(data, records)):
+                    yield body
+
+    def _single_hits(self, data, records):
+        for _, _, _, start, end in records:
+            if end - start > HIT_MAX_BYTES:
+                self.skipped += 1
+            else:
+                yield data[start:end]
+
+    def replay(self, now=None):
+        """Send the recorded hits and generate the responses in order."""
+        if now is None:
+            now = time.time()
+        with open(self.path, 'rb') as f:
+            f.seek(0, 2)
+            if not f.tell():
+                return
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            in_flight = collections.deque()
+            for body, headers in self._bodies(data, now):
+                if len(in_flight) >= self.max_in_flight:
+                    yield in_flight.popleft().get_result()
+                in_flight.append(_request(self.transport, body, headers,
+                                          self.deadline, uri=BATCH_URI))
+            while in_flight:
+                yield in_flight.popleft().get_result()
+        finally:
+            data.close()
@@ -0,0 +1,89 @@
+import random
+import time
+
+from . import _request
+
+
+class RetryPolicy(object):
+    """How `report()` retries requests that failed.
+
+    A request is retried when it raises one of `retryable_errors`, by default
+    the errors of the transport, or when the response has one of
+    `retryable_statuses`. Attempt `n` waits up to
+    `initial_delay * multiplier ** (n - 1)` seconds, capped by `max_delay`,
+    minus a random share of up to `jitter` of it. No more than `max_attempts`
+    attempts are made, and none after `budget` seconds since the first one.
+    """
+
+    def __init__(self, max_attempts=3, initial_delay=0.1, max_delay=5,
+                 multiplier=2, jitter=1.0,
+                 retryable_statuses=(429, 500, 502, 503, 504),
+                 retryable_errors=None, budget=None, sleep=time.sleep):
+        self.max_attempts = max_attempts
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.retryable_statuses = frozenset(retryable_statuses)
+        self.retryable_errors = retryable_errors
+        self.budget = budget
+        self.sleep = sleep
+
+    def delay(self, attempt):
+        """Return the time to wait after failed attempt number `attempt`."""
+        delay = min(self.initial_delay * self.multiplier ** (attempt - 1),
+                    self.max_delay)
+        return delay * (1 - self.jitter * random.random())
+
+    def send(self, transport, requests, headers, deadline=None,
+             dead_letter=None):
+        """Send (uri, body) requests and generate their responses.
+
+        All requests are started at once, then each failed one is retried
+        in turn. A request still failing after the last attempt is handed to
+        `dead_letter(uri, body, headers, error)` if given, with `error`
+        being either the exception or the response. Otherwise the exception
+        is raised or the response generated as is.
+        """
+        retryable_errors = self.retryable_errors
+        if retryable_errors is None:
+            retryable_errors = transport.errors
+        started = time.time()
+        futures = [_request(transport, body, headers, deadline, uri=uri)
+                   for uri, body in requests]
+        for (uri, body), future in zip(requests, futures):
+            attempt = 1
+            while True:
+                try:
+                    response = future.get_result()
+                except retryable_errors as e:
+                    error = e
+                else:
+                    if response.status_code not in self.retryable_statuses:
+                        yield response
+                        break
+                    error = response
+
+                delay = self.delay(attempt)
+                attempt_deadline = deadline
+                if self.budget is not None:
+                    remaining = self.budget - (time.time() - started) - delay
+                    if remaining <= 0:
+                        attempt = self.max_attempts
+                    elif attempt_deadline is None:
+                        attempt_deadline = remaining
+                    else:
+                        attempt_deadline = min(attempt_deadline, remaining)
+                if attempt >= self.max_attempts:
+                    if dead_letter is not None:
+                        dead_letter(uri, body, headers, error)
+                    elif isinstance(error, Exception):
+                        raise error
+                    else:
+                        yield error
+                    break
+
+                self.sleep(delay)
+                attempt += 1
+                future = _request(transport, body, headers, attempt_deadline,
+                                  uri=uri)
@@ -0,0 +1,93 @@
+import collections
+import threading
+import time
+import zlib
+
+from .validator import LRUCache
+
+
+class TokenBucket(object):
+    """Allow `rate` hits per second on average, in bursts of `capacity`."""
+
+    def __init__(self, rate, capacity, clock=time.time):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.updated = clock()
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+
+class Sampler(object):
+    """Decide which hits are worth sending.
+
+    `rate` is the share of clients whose hits are sent. It is derived from a
+    hash of the client ID, so a client is either fully in or out of the
+    sample, in every process.
+
+    `per_property`, `per_hit_type` and `per_client` are `(rate, capacity)`
+    pairs configuring a `TokenBucket` per tracking ID, per tracking ID and
+    hit type, and per client ID, or `None` for no limit. The hits of a
+    requestable are sent only if all their buckets have enough tokens for
+    all of them, so they are never partly reported. At most `max_buckets`
+    buckets are kept, the least recently used being forgotten.
+
+    Hits left out by `encoded_payloads()` are counted in `sampled_out` and
+    `limited`.
+    """
+
+    def __init__(self, rate=1.0, per_property=None, per_hit_type=None,
+                 per_client=None, max_buckets=10000, clock=time.time):
+        self.rate = rate
+        self.limits = (per_property, per_hit_type, per_client)
+        self.clock = clock
+        self.sampled_out = 0
+        self.limited = 0
+        self._threshold = int(rate * 0x100000000)
+        self._buckets = LRUCache(max_buckets)
+        self._lock = threading.Lock()
+
+    def sample(self, client_id):
+        """Return whether hits of `client_id` belong to the sample."""
+        if self._threshold > 0xffffffff:
+            return True
+        return (zlib.crc32(str(client_id)) & 0xffffffff) < self._threshold
+
+    def allow(self, tracking_id, client_id, hit_type):
+        """Take a token for a hit from all its buckets if they have one."""
+        return self.allow_all(tracking_id, client_id, (hit_type,))
+
+    def allow_all(self, tracking_id, client_id, hit_types):
+        """Take tokens for hits of `hit_types` if all are allowed, else none.
+
+        Hits beyond the capacity of a bucket are let through when it is
+        full, leaving it in debt until it is refilled.
+        """
+        needed = collections.OrderedDict()
+        for hit_type in hit_types:
+            keys = ((tracking_id,), (tracking_id, 't', hit_type),
+                    (tracking_id, 'cid', client_id))
+            for key, limit in zip(keys, self.limits):
+                if limit is not None:
+                    count = needed.get(key, (limit, 0))[1]
+                    needed[key] = (limit, count + 1)
+        with self._lock:
+            buckets = []
+            for key, (limit, count) in needed.iteritems():
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = TokenBucket(limit[0], limit[1], self.clock)
+                    self._buckets.set(key, bucket)
+                if bucket.refill() < min(count, bucket.capacity):
+                    self.limited += len(hit_types)
+                    return False
+                buckets.append((bucket, count))
+            for bucket, count in buckets:
+                bucket.tokens -= count
+            return True
@@ -0,0 +1,54 @@
+from collections import deque
+
+from google.appengine.ext import ndb
+
+from . import VALIDATE_OFF, _request, _requests, _settled
+
+
+def _as_future(future):
+    if isinstance(future, ndb.Future):
+        return future
+    ndb_future = ndb.Future()
+    exception = future.get_exception()
+    if exception is not None:
+        ndb_future.set_exception(exception)
+    else:
+        ndb_future.set_result(future.get_result())
+    return ndb_future
+
+
+@ndb.tasklet
+def report_tasklet(tracking_id, client_id, requestable, extra_info=None,
+                   extra_headers=None, deadline=None, batch=False,
+                   validate=VALIDATE_OFF, validation_stats=None,
+                   transport=None, sampler=None, dedup=None,
+                   max_concurrent=10):
+    """Report measurements from an NDB tasklet.
+
+    Requests are started as soon as fewer than `max_concurrent` of them are
+    in flight. The tasklet completes with the list of responses, in order,
+    once all requests have finished, and raises the first failure if any.
+    Other arguments are those of `report_async()`:
+
+        responses = yield report_tasklet(tracking_id, client_id, view)
+    """
+    futures = []
+    in_flight = deque()
+    for uri, body, keys in _requests(tracking_id, client_id, requestable,
+                                     extra_info, extra_headers, batch,
+                                     validate, validation_stats, sampler,
+                                     dedup):
+        if len(in_flight) >= max_concurrent:
+            try:
+                yield in_flight.popleft()
+            except Exception:
+                # Failures are raised once all requests have finished.
+                pass
+        future = _request(transport, body, extra_headers, deadline, uri=uri)
+        if keys:
+            future.add_callback(_settled, dedup, keys, future)
+        future = _as_future(future)
+        in_flight.append(future)
+        futures.append(future)
+    responses = yield futures
+    raise ndb.Return(responses)
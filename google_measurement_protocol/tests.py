@@ -1,4 +1,19 @@
+from io import BytesIO
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 from unittest import TestCase
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
 try:
     from urllib.parse import parse_qs
 except ImportError:
@@ -6,14 +21,34 @@ except ImportError:
 
 from google.appengine.api import apiproxy_stub_map
 from google.appengine.api import urlfetch_stub
+from google.appengine.api.memcache import memcache_stub
 from minimock import mock
 from prices import Price
 
-from . import (Event, Item, PageView, report, SystemInfo, Requestable,
-               Transaction, payloads)
+from .buffer import BLOCK, BufferFull, HitBuffer, REJECT
+from .bulk import import_hits, read_records, to_requestable
+from .dedup import (BloomDeduplicator, Deduplicator, MemcacheDeduplicator,
+                    fingerprint)
+from .deferred import DeferredReporter, LocalQueue
+from .hooks import Histogram, Metrics
+from .replay import Recorder, Replayer
+from .retry import RetryPolicy
+from .sampling import Sampler, TokenBucket
+from .tasklets import report_tasklet
+from .transport import FakeTransport, HTTPTransport, Response, Result
+from . import validator
+from . import (Event, ImpressionList, Item, PageView, Product, ProductAction,
+               product_keys, report, report_async, sum_prices, SystemInfo,
+               Requestable,
+               Transaction, payloads, batches, BATCH_URI, TRACKING_URI, BATCH_MAX_BYTES, HIT_MAX_BYTES,
+               InvalidHit, PayloadEncoder, Property, ValidationStats,
+               QUEUE_TIME_MAX, encoded_payloads,
+               stamp_queue_time, set_hooks, VALIDATE_ANNOTATE, VALIDATE_DROP,
+               VALIDATE_OFF, VALIDATE_RAISE)
 
 apiproxy_stub_map.apiproxy = apiproxy_stub_map.APIProxyStubMap()
 apiproxy_stub_map.apiproxy.RegisterStub('urlfetch', urlfetch_stub.URLFetchServiceStub())
+apiproxy_stub_map.apiproxy.RegisterStub('memcache', memcache_stub.MemcacheServiceStub())
 
 def Dummy_RetrieveURL(self, url, payload, method, headers, request, response,
                       follow_redirects, deadline, validate_certificate):
@@ -49,6 +84,46 @@ class ReportTest(TestCase):
         data = parse_qs(response.content)
         self.assertEqual(data['ul'], ['en-gb'])
 
+    def test_report_batch(self):
+        items = [Item('item-%02d' % i, Price(10, currency='USD'))
+                 for i in range(30)]
+        trans = Transaction('trans-01', items)
+        responses = list(report('UA-123456-78', 'CID', trans, batch=True))
+        self.assertEqual(len(responses), 2)
+        hits = [response.content.split('\n') for response in responses]
+        self.assertEqual([len(h) for h in hits], [20, 11])
+        data = parse_qs(hits[0][0])
+        self.assertEqual(data['t'], ['transaction'])
+        self.assertEqual(data['cid'], ['CID'])
+
+
+class BatchesTest(TestCase):
+
+    def test_max_hits(self):
+        bodies = list(batches(['t=mock'] * 45))
+        self.assertEqual([len(b.split('\n')) for b in bodies], [20, 20, 5])
+
+    def test_max_bytes(self):
+        hit = 'x' * (HIT_MAX_BYTES - 1)
+        bodies = list(batches([hit] * 5))
+        self.assertEqual([len(b.split('\n')) for b in bodies], [2, 2, 1])
+        for body in bodies:
+            self.assertTrue(len(body) <= BATCH_MAX_BYTES)
+
+    def test_hit_too_large(self):
+        hit = 'x' * (HIT_MAX_BYTES + 1)
+        self.assertRaises(ValueError, lambda: list(batches([hit])))
+
+    def test_hit_too_large_sends_nothing(self):
+        transport = FakeTransport()
+        items = [Item('item-%02d' % i, Price(10, currency='USD'))
+                 for i in range(25)]
+        items.append(Item('x' * HIT_MAX_BYTES, Price(10, currency='USD')))
+        self.assertRaises(
+            ValueError, report_async, 'UA-123456-78', 'CID',
+            Transaction('trans-01', items), batch=True, transport=transport)
+        self.assertEqual(transport.requests, [])
+
 
 class PageViewTest(TestCase):
 
@@ -146,6 +221,17 @@ class TransactionTest(TestCase):
             {'t': 'transaction', 'ti': 'trans-01', 'cu': 'USD', 'tr': '110',
              'ts': '100', 'tt': '0'})
 
+    def test_overridden_subtotal(self):
+
+        class DiscountedItem(Item):
+            def get_subtotal(self):
+                return Price(1, currency='USD')
+
+        items = [DiscountedItem('item-01', Price(10, currency='USD')),
+                 Item('item-02', Price(5, currency='USD'))]
+        trans = Transaction('trans-01', items)
+        self.assertEqual(trans.get_total(), Price(6, currency='USD'))
+
     def test_affiliation(self):
         items = [Item('item-01', Price(10, currency='USD'))]
         trans = Transaction('trans-01', items, affiliation='loyalty')
@@ -161,6 +247,181 @@ class TransactionTest(TestCase):
         trans_payloads = list(trans)
         self.assertEqual(len(trans_payloads), 3)
 
+    def test_total(self):
+        items = [Item('item-01', Price(net=10, gross=12, currency='USD'),
+                      quantity=3),
+                 Item('item-02', Price(5, currency='USD'))]
+        trans = Transaction('trans-01', items,
+                            shipping=Price(7, currency='USD'))
+        total = trans.get_total()
+        self.assertEqual(total, Price(net=42, gross=48, currency='USD'))
+        self.assertIs(trans.get_total(), total)
+
+    def test_mixed_currencies(self):
+        items = [Item('item-01', Price(10, currency='USD')),
+                 Item('item-02', Price(10, currency='EUR'))]
+        trans = Transaction('trans-01', items)
+        self.assertRaises(ValueError, trans.get_total)
+
+
+class SumPricesTest(TestCase):
+
+    def test_sum_prices(self):
+        prices = [Price(net=10, gross=12, currency='USD'),
+                  Price(5, currency='USD')]
+        self.assertEqual(sum_prices(prices),
+                         Price(net=15, gross=17, currency='USD'))
+        self.assertEqual(sum_prices(prices, [2, 1]),
+                         Price(net=25, gross=29, currency='USD'))
+
+    def test_mixed_currencies(self):
+        self.assertRaises(ValueError, sum_prices,
+                          [Price(10, currency='USD'),
+                           Price(10, currency='EUR')])
+
+
+class ProductActionTest(TestCase):
+
+    def test_purchase(self):
+        products = [Product('P1', 'Shoes', price=Price(20, currency='EUR'),
+                            quantity=2),
+                    Product('P2', brand='Acme', variant='blue')]
+        action = ProductAction(
+            PageView('/checkout/'), 'purchase', products,
+            transaction_id='trans-01',
+            revenue=Price(net=40, gross=48, currency='EUR'), coupon='SALE')
+        self.assertEqual(
+            action.get_payload(),
+            {'t': 'pageview', 'dp': '/checkout/', 'pa': 'purchase',
+             'ti': 'trans-01', 'tr': '48', 'tt': '8', 'tcc': 'SALE',
+             'cu': 'EUR', 'pr1id': 'P1', 'pr1nm': 'Shoes', 'pr1pr': '20',
+             'pr1qt': 2, 'pr2id': 'P2', 'pr2br': 'Acme', 'pr2va': 'blue'})
+        (hit, _), = payloads('UA-1234-5',
+                             '35009a79-1a05-49d7-b876-2b884d0f825b', action,
+                             validate=VALIDATE_RAISE)
+        self.assertEqual(hit['pr1pr'], '20')
+
+    def test_impressions(self):
+        impressions = [
+            ImpressionList('Search', [Product('P1', position=1),
+                                      Product('P2', quantity=3)]),
+            ImpressionList('Related', [Product(name='Socks')])]
+        action = ProductAction(Event('ui', 'scroll'),
+                               impressions=impressions)
+        self.assertEqual(
+            action.get_payload(),
+            {'t': 'event', 'ec': 'ui', 'ea': 'scroll', 'il1nm': 'Search',
+             'il1pi1id': 'P1', 'il1pi1ps': 1, 'il1pi2id': 'P2',
+             'il2nm': 'Related', 'il2pi1nm': 'Socks'})
+
+    def test_mixed_currencies(self):
+        products = [Product('P1', price=Price(20, currency='EUR')),
+                    Product('P2', price=Price(20, currency='USD'))]
+        action = ProductAction(PageView('/checkout/'), 'add', products)
+        self.assertRaises(ValueError, action.get_currency)
+        self.assertRaises(ValueError, action.get_payload)
+
+    def test_overridden_get_payload(self):
+
+        class CustomView(PageView):
+            def get_payload(self):
+                payload = super(CustomView, self).get_payload()
+                payload['cd1'] = 'member'
+                return payload
+
+        action = ProductAction(CustomView('/my-page/'), 'detail',
+                               [Product('P1')])
+        self.assertEqual(action.get_payload()['cd1'], 'member')
+
+    def test_limits(self):
+        products = [Product('P%d' % i) for i in range(201)]
+        self.assertRaises(ValueError, ProductAction, PageView('/'), 'detail',
+                          products)
+        self.assertRaises(ValueError, ImpressionList, 'Search', products)
+        self.assertRaises(ValueError, ProductAction, PageView('/'), 'buy')
+        self.assertRaises(ValueError, ProductAction, PageView('/'), 'refund')
+        self.assertRaises(ValueError, Product)
+
+    def test_product_keys(self):
+        self.assertEqual(product_keys(199)[0], 'pr200id')
+        self.assertEqual(product_keys(0, 1),
+                         ('il2pi1id', 'il2pi1nm', 'il2pi1br', 'il2pi1ca',
+                          'il2pi1va', 'il2pi1pr', None, None, 'il2pi1ps'))
+        self.assertIs(product_keys(3), product_keys(3))
+
+
+class IterHitsTest(TestCase):
+
+    def test_iter_hits(self):
+        items = [Item('item-01', Price(10, currency='USD'), quantity=2),
+                 Item('item-02', Price(10, currency='USD'), item_id='it02')]
+        requestables = [PageView('/my-page/', title='title'),
+                        Event('category', 'action', label='label', value=7),
+                        SystemInfo(language='en-gb'),
+                        Transaction('trans-01', items), MockRequestable()]
+        for requestable in requestables:
+            self.assertEqual([dict(pairs) for pairs in requestable.iter_hits()],
+                             list(requestable))
+
+    def test_overridden_get_payload(self):
+
+        class CustomView(PageView):
+            def get_payload(self):
+                payload = super(CustomView, self).get_payload()
+                payload['cd1'] = 'member'
+                return payload
+
+        class CustomItem(Item):
+            def get_payload_for_transaction(self, transaction_id):
+                payload = super(CustomItem, self).get_payload_for_transaction(
+                    transaction_id)
+                payload['cd1'] = 'gift'
+                return payload
+
+        transaction = Transaction(
+            'trans-01', [CustomItem('item-01', Price(10, currency='USD'))])
+        for requestable in (CustomView('/my-page/'), transaction):
+            self.assertEqual([dict(pairs) for pairs in requestable.iter_hits()],
+                             list(requestable))
+            for validate in (VALIDATE_OFF, VALIDATE_ANNOTATE):
+                transport = FakeTransport()
+                list(report('UA-123456-78', 'CID', requestable,
+                            validate=validate, transport=transport))
+                sent = [parse_qs(body) for _, body, _ in transport.requests]
+                self.assertEqual(
+                    [sorted(set(hit) - set(['v', 'tid', 'cid']))
+                     for hit in sent],
+                    [sorted(payload) for payload in requestable])
+                self.assertTrue(all('cd1' in hit for hit in sent[-1:]))
+
+    def test_overridden_iter(self):
+
+        class TwiceView(PageView):
+            def __iter__(self):
+                yield self.get_payload()
+                yield self.get_payload()
+
+        view = TwiceView('/my-page/')
+        self.assertEqual(len(list(view.iter_hits())), 2)
+        self.assertEqual(len(list(payloads('UA-123456-78', 'CID', view))), 2)
+        self.assertEqual(
+            len(list(encoded_payloads('UA-123456-78', 'CID', view))), 2)
+
+    def test_iterable_of_dicts(self):
+        transport = FakeTransport()
+        futures = report_async('UA-1234-5', 'CID', [{'t': 'pageview'}],
+                               transport=transport)
+        self.assertEqual(len(futures), 1)
+        (response,) = report('UA-1234-5', 'CID', [{'t': 'pageview'}],
+                             sampler=Sampler(), transport=transport)
+        self.assertEqual(parse_qs(response.content)['t'], ['pageview'])
+
+    def test_slots(self):
+        view = PageView('/my-page/')
+        self.assertRaises(AttributeError, setattr, view, 'extra', 1)
+        item = Item('item-01', Price(10, currency='USD'))
+        self.assertRaises(AttributeError, setattr, item, 'extra', 1)
+
 
 class PayloadsTest(TestCase):
 
@@ -181,3 +442,983 @@ class PayloadsTest(TestCase):
             self.assertEqual(data['cid'], 'client-id')
             self.assertEqual(data['ul'], 'en-gb')
             self.assertTrue(headers['extra-header-key'], 'extra-header-value')
+
+
+class PayloadEncoderTest(TestCase):
+
+    def test_encode(self):
+        trans = Transaction('trans-01',
+                            [Item('item 01', Price(10, currency='USD'))])
+        info = SystemInfo(language='en-gb')
+        encoder = PayloadEncoder('tracking-id', 'client-id', info)
+        expected = [data for data, _ in payloads(
+            'tracking-id', 'client-id', trans, info)]
+        encoded = [encoder.encode(payload) for payload in trans]
+        self.assertEqual(
+            [dict((k, v) for k, (v,) in parse_qs(e).items()) for e in encoded],
+            expected)
+
+    def test_common_params_take_precedence(self):
+        encoder = PayloadEncoder('tracking-id', 'client-id')
+        data = parse_qs(encoder.encode({'t': 'mock', 'tid': 'other'}))
+        self.assertEqual(data['tid'], ['tracking-id'])
+        self.assertEqual(data['t'], ['mock'])
+
+
+class FanOutTest(TestCase):
+
+    def setUp(self):
+        self.transaction = Transaction(
+            'trans-01', [Item('item 01', Price(10, currency='USD')),
+                         Item('item 02', Price(5, currency='USD'))])
+
+    def decoded(self, data):
+        return dict((k, v) for k, (v,) in parse_qs(data).items())
+
+    def test_shared_encoding(self):
+        fanned_out = [self.decoded(data) for data, _ in encoded_payloads(
+            ['UA-123456-1', 'UA-123456-2'], 'CID', self.transaction)]
+        expected = []
+        for one, two in zip(
+                payloads('UA-123456-1', 'CID', self.transaction),
+                payloads('UA-123456-2', 'CID', self.transaction)):
+            expected.extend([one[0], two[0]])
+        self.assertEqual(fanned_out, expected)
+
+    def test_overrides_and_filter(self):
+        properties = [
+            'UA-123456-1',
+            Property('UA-123456-2', overrides={'ta': 'brand', 'cu': 'EUR'},
+                     filter=lambda hit: hit['t'] == 'transaction')]
+        hits = [self.decoded(data) for data, _ in encoded_payloads(
+            properties, 'CID', self.transaction)]
+        self.assertEqual([(hit['tid'], hit['t']) for hit in hits],
+                         [('UA-123456-1', 'transaction'),
+                          ('UA-123456-2', 'transaction'),
+                          ('UA-123456-1', 'item'),
+                          ('UA-123456-1', 'item')])
+        self.assertEqual(hits[1]['ta'], 'brand')
+        self.assertEqual(hits[1]['cu'], 'EUR')
+        self.assertEqual(hits[0]['cu'], 'USD')
+
+    def test_batch(self):
+        transport = FakeTransport()
+        (response,) = report(['UA-123456-1', 'UA-123456-2'], 'CID',
+                             self.transaction, batch=True,
+                             transport=transport)
+        ((uri, body, _),) = transport.requests
+        self.assertEqual(uri, BATCH_URI)
+        self.assertEqual(len(body.split('\n')), 6)
+
+    def test_no_property(self):
+        self.assertRaises(ValueError, list,
+                          encoded_payloads([], 'CID', self.transaction))
+
+
+class ValidatePayloadsTest(TestCase):
+
+    client_id = '35009a79-1a05-49d7-b876-2b884d0f825b'
+
+    def test_drop(self):
+        stats = ValidationStats()
+        hits = list(payloads('UA-1234-5', self.client_id,
+                             Event('category', 'action', value=3),
+                             validate=VALIDATE_DROP, validation_stats=stats))
+        self.assertEqual(len(hits), 1)
+        hits = list(payloads('UA-1234-5', 'CID', PageView('/my-page/'),
+                             validate=VALIDATE_DROP, validation_stats=stats))
+        self.assertEqual(hits, [])
+        self.assertEqual((stats.hits, stats.invalid, stats.dropped), (2, 1, 1))
+        self.assertEqual(stats.errors, {'cid': 1})
+
+    def test_raise(self):
+        try:
+            list(payloads('UA-XXXX-Y', self.client_id, PageView('/my-page/'),
+                          validate=VALIDATE_RAISE))
+        except InvalidHit as e:
+            self.assertEqual(list(e.errors), ['tid'])
+        else:
+            self.fail('InvalidHit not raised')
+
+    def test_annotate(self):
+        stats = ValidationStats()
+        mr = MockRequestable()
+        (response,) = report('UA-123456-78', 'CID', mr,
+                             validate=VALIDATE_ANNOTATE,
+                             validation_stats=stats)
+        self.assertEqual(parse_qs(response.content)['t'], ['mock'])
+        self.assertEqual(sorted(stats.errors), ['cid', 't'])
+        self.assertEqual(stats.dropped, 0)
+        (annotated,) = stats.annotated
+        self.assertEqual(annotated['t'], 'mock')
+        self.assertEqual(sorted(annotated.errors), ['cid', 't'])
+
+    def test_annotate_payloads(self):
+        hits = [data for data, _ in payloads(
+            'UA-1234-5', self.client_id,
+            [PageView('/my-page/').get_payload(), {'t': 'mock'}],
+            validate=VALIDATE_ANNOTATE)]
+        self.assertEqual([sorted(hit.errors) for hit in hits], [[], ['t']])
+        self.assertEqual(hits[1], {'t': 'mock', 'v': '1', 'tid': 'UA-1234-5',
+                                   'cid': self.client_id})
+
+    def test_unknown_mode(self):
+        self.assertRaises(ValueError, lambda: list(payloads(
+            'UA-1234-5', self.client_id, PageView('/'), validate='maybe')))
+
+
+class MemoizationTest(TestCase):
+
+    def tearDown(self):
+        validator.enable_memoization(None)
+
+    def test_memoization(self):
+        plain = validator.is_dl
+        validator.enable_memoization(16)
+        self.assertIsNot(validator.is_dl, plain)
+        hits = [{'dl': 'http://www.example.com/page-%d' % (i % 4),
+                 'dh': 'www.example.com', 'dp': '%d' % i}
+                for i in range(40)]
+        threads = [threading.Thread(target=lambda: [
+            validator.validate_payload(hit) for hit in hits])
+            for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = validator.memoization_stats()
+        self.assertEqual(sorted(stats), ['dh', 'dl', 'dp', 'dr'])
+        self.assertEqual(stats['dl']['hits'] + stats['dl']['misses'], 160)
+        self.assertTrue(stats['dl']['hit_rate'] > 0.9)
+        self.assertTrue(stats['dp']['size'] <= 16)
+        self.assertIn('dp', validator.validate_payload({'dp': '1'}))
+        self.assertNotIn('dp', validator.validate_payload({'dp': '/1'}))
+        validator.enable_memoization(None)
+        self.assertIs(validator.is_dl, plain)
+        self.assertEqual(validator.memoization_stats(), {})
+
+
+class QueueTimeTest(TestCase):
+
+    def test_stamp(self):
+        self.assertEqual(stamp_queue_time('v=1&t=mock', 100, now=101.5),
+                         'v=1&t=mock&qt=1500')
+
+    def test_existing_queue_time(self):
+        self.assertEqual(stamp_queue_time('v=1&qt=250&t=mock', 100, now=101),
+                         'v=1&t=mock&qt=1250')
+
+    def test_expired(self):
+        self.assertEqual(
+            stamp_queue_time('v=1&t=mock', 0, now=QUEUE_TIME_MAX + 1), None)
+
+    def test_buffer(self):
+        transport = FakeTransport()
+        buf = HitBuffer(transport=transport)
+        buf.add('UA-123456-78', 'CID', PageView('/my-page/'))
+        buf.add('UA-123456-78', 'CID', PageView('/other-page/'))
+        buf._hits[0] = buf._hits[0][:2] + (0,)
+        buf.flush()
+        ((_, body, _),) = transport.requests
+        data = parse_qs(body)
+        self.assertEqual(data['dp'], ['/other-page/'])
+        self.assertTrue(0 <= int(data['qt'][0]) < 1000)
+        self.assertEqual(buf.expired, 1)
+
+    def test_deferred_reporter(self):
+        transport = FakeTransport()
+        queue = LocalQueue()
+        reporter = DeferredReporter(queue, transport=transport)
+        reporter.report('UA-123456-78', 'CID', PageView('/my-page/'))
+        queue.add('{"headers": {}, "hits": ["t=pageview"], "time": 0}')
+        self.assertEqual(reporter.process(), 1)
+        self.assertEqual(reporter.expired, 1)
+        ((_, body, _),) = transport.requests
+        self.assertTrue('qt' in parse_qs(body))
+        self.assertEqual(len(queue), 0)
+
+
+class DeferredReporterTest(TestCase):
+
+    def test_process(self):
+        queue = LocalQueue()
+        reporter = DeferredReporter(queue)
+        items = [Item('item-%02d' % i, Price(10, currency='USD'))
+                 for i in range(30)]
+        reporter.report('UA-123456-78', 'CID', Transaction('trans-01', items))
+        reporter.report('UA-123456-78', 'CID', PageView('/my-page/'),
+                        extra_headers={'user-agent': 'my-user-agent 1.0'})
+        self.assertEqual(len(queue), 2)
+        self.assertEqual(reporter.process(), 32)
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(reporter.process(), 0)
+
+    def test_server_error(self):
+        queue = LocalQueue()
+        reporter = DeferredReporter(queue, lease_seconds=0,
+                                    transport=FlakyTransport([503]))
+        reporter.report('UA-123456-78', 'CID', PageView('/my-page/'))
+        self.assertEqual(reporter.process(), 0)
+        self.assertEqual(len(queue), 1)
+        self.assertEqual(reporter.process(), 1)
+        self.assertEqual(len(queue), 0)
+
+    def test_client_error(self):
+        queue = LocalQueue()
+        reporter = DeferredReporter(queue, transport=FlakyTransport([400]))
+        reporter.report('UA-123456-78', 'CID', PageView('/my-page/'))
+        self.assertEqual(reporter.process(), 0)
+        self.assertEqual(reporter.dropped, 1)
+        self.assertEqual(len(queue), 0)
+
+    def test_lease(self):
+        queue = LocalQueue()
+        queue.add('a')
+        queue.add('b')
+        (task,) = queue.lease(60, 1)
+        self.assertEqual(task.payload, 'a')
+        (task,) = queue.lease(60, 10)
+        self.assertEqual(task.payload, 'b')
+        self.assertEqual(queue.lease(60, 10), [])
+        self.assertEqual(len(queue), 2)
+
+
+class HitBufferTest(TestCase):
+
+    def test_flush(self):
+        buf = HitBuffer(flush_hits=20)
+        for i in range(25):
+            buf.add('UA-123456-78', 'CID', PageView('/page-%d/' % i))
+        self.assertEqual(len(buf), 5)
+        buf.flush()
+        self.assertEqual(len(buf), 0)
+        buf.wait()
+        self.assertEqual(buf.failed, 0)
+
+    def test_max_age(self):
+        buf = HitBuffer(max_age=0)
+        buf.add('UA-123456-78', 'CID', PageView('/my-page/'))
+        self.assertEqual(len(buf), 0)
+
+    def test_drop_oldest(self):
+        buf = HitBuffer(capacity=2, flush_hits=100)
+        for i in range(3):
+            buf.add('UA-123456-78', 'CID', PageView('/page-%d/' % i))
+        self.assertEqual(len(buf), 2)
+        self.assertEqual(buf.dropped, 1)
+
+    def test_block(self):
+        buf = HitBuffer(capacity=2, flush_hits=100, policy=BLOCK)
+        for i in range(3):
+            buf.add('UA-123456-78', 'CID', PageView('/page-%d/' % i))
+        self.assertEqual(len(buf), 1)
+        self.assertEqual(buf.dropped, 0)
+
+    def test_failed(self):
+        buf = HitBuffer(transport=FlakyTransport([503, IOError('reset')]))
+        for i in range(3):
+            buf.add('UA-123456-78', 'CID', PageView('/page-%d/' % i))
+            buf.flush()
+        buf.wait()
+        self.assertEqual(buf.failed, 2)
+
+    def test_reject(self):
+        buf = HitBuffer(capacity=2, flush_hits=100, policy=REJECT)
+        mr = MockRequestable()
+        buf.add('UA-123456-78', 'CID', mr)
+        buf.add('UA-123456-78', 'CID', mr)
+        self.assertRaises(BufferFull,
+                          lambda: buf.add('UA-123456-78', 'CID', mr))
+
+    def test_hit_too_large(self):
+        buf = HitBuffer(flush_hits=100)
+        price = Price(10, currency='USD')
+        transaction = Transaction('T1', [Item('small', price),
+                                         Item('x' * 9000, price)])
+        self.assertRaises(ValueError, lambda: buf.add('UA-123456-78', 'CID',
+                                                      transaction))
+        self.assertEqual(len(buf), 0)
+
+
+class ReportTaskletTest(TestCase):
+
+    def test_report_tasklet(self):
+        views = [PageView('/page-%d/' % i) for i in range(5)]
+
+        class Views(Requestable):
+            def __iter__(self):
+                for view in views:
+                    yield view.get_payload()
+
+        responses = report_tasklet('UA-123456-78', 'CID', Views(),
+                                   max_concurrent=2).get_result()
+        self.assertEqual([parse_qs(r.content)['dp'] for r in responses],
+                         [['/page-%d/' % i] for i in range(5)])
+
+    def test_batch(self):
+        transport = FakeTransport()
+        items = [Item('item-%02d' % i, Price(10, currency='USD'))
+                 for i in range(30)]
+        responses = report_tasklet('UA-123456-78', 'CID',
+                                   Transaction('trans-01', items), batch=True,
+                                   transport=transport).get_result()
+        self.assertEqual(len(responses), 2)
+        self.assertEqual([uri for uri, _, _ in transport.requests],
+                         [BATCH_URI, BATCH_URI])
+
+
+class FlakyTransport(FakeTransport):
+
+    errors = (IOError,)
+
+    def __init__(self, failures):
+        super(FlakyTransport, self).__init__()
+        self.failures = list(failures)
+
+    def post(self, uri, body, headers, deadline=None):
+        result = super(FlakyTransport, self).post(uri, body, headers, deadline)
+        if not self.failures:
+            return result
+        failure = self.failures.pop(0)
+        if isinstance(failure, Exception):
+            return Result(exception=failure)
+        return Result(Response(failure, '', {}))
+
+
+class RetryTest(TestCase):
+
+    def test_retry(self):
+        transport = FlakyTransport([503, IOError('reset')])
+        retry = RetryPolicy(initial_delay=0)
+        (response,) = report('UA-123456-78', 'CID', MockRequestable(),
+                             transport=transport, retry=retry)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(transport.requests), 3)
+
+    def test_dead_letter(self):
+        transport = FlakyTransport([503] * 3)
+        dead = []
+        responses = list(report(
+            'UA-123456-78', 'CID', PageView('/my-page/'), transport=transport,
+            retry=RetryPolicy(initial_delay=0),
+            dead_letter=lambda uri, body, headers, error: dead.append(
+                (body, error))))
+        self.assertEqual(responses, [])
+        ((body, error),) = dead
+        self.assertEqual(parse_qs(body)['dp'], ['/my-page/'])
+        self.assertEqual(error.status_code, 503)
+
+    def test_exhausted(self):
+        transport = FlakyTransport([IOError('reset')] * 2)
+        retry = RetryPolicy(max_attempts=2, initial_delay=0)
+        self.assertRaises(IOError, lambda: list(report(
+            'UA-123456-78', 'CID', MockRequestable(), transport=transport,
+            retry=retry)))
+
+    def test_budget(self):
+        transport = FlakyTransport([503] * 3)
+        retry = RetryPolicy(max_attempts=5, initial_delay=10, jitter=0,
+                            budget=1, sleep=self.fail)
+        (response,) = report('UA-123456-78', 'CID', MockRequestable(),
+                             transport=transport, retry=retry)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(transport.requests), 1)
+
+    def test_delay(self):
+        retry = RetryPolicy(initial_delay=1, max_delay=3, jitter=0)
+        self.assertEqual([retry.delay(n) for n in range(1, 5)], [1, 2, 3, 3])
+
+
+class HooksTest(TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+        set_hooks(self.metrics)
+
+    def tearDown(self):
+        set_hooks(None)
+
+    def test_report(self):
+        transport = FlakyTransport([500])
+        list(report('UA-123456-78', 'CID', PageView('/my-page/'),
+                    transport=transport))
+        list(report('UA-123456-78', 'CID', PageView('/my-page/'),
+                    transport=transport))
+        counters = self.metrics.counters
+        self.assertEqual(counters['hits'], 2)
+        self.assertEqual(counters['requests'], 2)
+        self.assertEqual(counters['failed'], 1)
+        self.assertEqual(counters['succeeded'], 1)
+        self.assertEqual(self.metrics.build.count, 2)
+        self.assertEqual(self.metrics.encode.count, 2)
+        self.assertEqual(self.metrics.request.count, 2)
+
+    def test_batch(self):
+        transport = FakeTransport()
+        transaction = Transaction(
+            'trans-01', [Item('item-01', Price(10, currency='USD'))])
+        list(report('UA-123456-78', 'CID', transaction,
+                    transport=transport, batch=True))
+        self.assertEqual(self.metrics.counters['requests'], 1)
+        self.assertEqual(self.metrics.counters['hits_sent'], 2)
+
+    def test_dropped(self):
+        list(report('UA-123456-78', 'CID', PageView('/my-page/'),
+                    transport=FakeTransport(), validate=VALIDATE_DROP))
+        list(report('UA-123456-78', 'CID', PageView('/my-page/'),
+                    transport=FakeTransport(), sampler=Sampler(rate=0)))
+        self.assertEqual(self.metrics.counters['dropped_invalid'], 1)
+        self.assertEqual(self.metrics.counters['dropped_sampled'], 1)
+        self.assertEqual(self.metrics.counters['requests'], 0)
+
+    def test_retry(self):
+        transport = FlakyTransport([503])
+        retry = RetryPolicy(initial_delay=0)
+        list(report('UA-123456-78', 'CID', PageView('/my-page/'),
+                    transport=transport, retry=retry))
+        self.assertEqual(self.metrics.counters['requests'], 2)
+        self.assertEqual(self.metrics.counters['failed'], 1)
+
+    def test_histogram(self):
+        histogram = Histogram(size=100)
+        for value in range(200):
+            histogram.add(value)
+        self.assertEqual(histogram.count, 200)
+        self.assertEqual(histogram.percentile(0), 100)
+        self.assertEqual(histogram.percentile(50), 150)
+        self.assertEqual(histogram.percentile(100), 199)
+        self.assertEqual(Histogram().percentile(50), None)
+
+
+class BulkImportTest(TestCase):
+
+    client_id = '35009a79-1a05-49d7-b876-2b884d0f825b'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.directory, 'checkpoint')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _jsonl(self, count):
+        return BytesIO(''.join(
+            json.dumps({'type': 'pageview', 'client_id': self.client_id,
+                        'path': '/page-%d/' % i}) + '\n'
+            for i in range(count)).encode('ascii'))
+
+    def test_read_records(self):
+        f = BytesIO(b'type,client_id,path\npageview,CID,/a/\n\n'
+                    b'pageview,CID,/b/\n')
+        records = list(read_records(f, 'csv'))
+        self.assertEqual(
+            records,
+            [({'type': 'pageview', 'client_id': 'CID', 'path': '/a/'}, 37),
+             ({'type': 'pageview', 'client_id': 'CID', 'path': '/b/'}, 55)])
+        self.assertEqual([record for record, _ in read_records(f, 'csv', 37)],
+                         [records[1][0]])
+
+    def test_to_requestable(self):
+        self.assertEqual(
+            to_requestable({'type': 'event', 'category': 'video',
+                            'action': 'play', 'label': ''}),
+            Event('video', 'play'))
+        transaction = to_requestable(
+            {'type': 'transaction', 'transaction_id': 'trans-01',
+             'currency': 'USD', 'shipping': '5',
+             'items': '[{"name": "item-01", "price": "10", "quantity": 2}]'})
+        self.assertEqual(transaction.get_total(), Price(25, currency='USD'))
+        self.assertRaises(ValueError, to_requestable, {'type': 'screenview'})
+
+    def test_import(self):
+        transport = FakeTransport()
+        stats = import_hits(self._jsonl(45), 'UA-1234-5', transport=transport,
+                            checkpoint=self.checkpoint)
+        self.assertEqual(len(transport.requests), 3)
+        self.assertEqual(transport.requests[0][0], BATCH_URI)
+        self.assertEqual((stats.records, stats.sent, stats.requests),
+                         (45, 45, 3))
+        with open(self.checkpoint) as f:
+            self.assertEqual(int(f.read()), stats.offset)
+
+    def test_resume(self):
+        transport = FlakyTransport([200, 503])
+        self.assertRaises(IOError, import_hits, self._jsonl(45), 'UA-1234-5',
+                          transport=transport, checkpoint=self.checkpoint)
+        stats = import_hits(self._jsonl(45), 'UA-1234-5', transport=transport,
+                            checkpoint=self.checkpoint)
+        self.assertEqual(stats.records, 25)
+        bodies = [body for _, body, _ in transport.requests]
+        self.assertEqual(bodies[1], bodies[2])
+
+    def test_drop_invalid(self):
+        f = BytesIO(b'{"type": "pageview", "client_id": "CID"}\n')
+        stats = import_hits(f, 'UA-1234-5', transport=FakeTransport(),
+                            checkpoint=self.checkpoint)
+        self.assertEqual((stats.dropped, stats.requests), (1, 0))
+        self.assertEqual(stats.offset, f.tell())
+
+
+class ReplayTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'hits')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_replay(self):
+        recorder = Recorder(self.path)
+        items = [Item('item-%02d' % i, Price(10, currency='USD'))
+                 for i in range(30)]
+        list(report('UA-123456-78', 'CID', PageView('/my-page/'),
+                    transport=recorder))
+        list(report('UA-123456-78', 'CID', Transaction('trans-01', items),
+                    transport=recorder, batch=True))
+        transport = FakeTransport()
+        replayer = Replayer(self.path, transport, max_in_flight=1)
+        responses = list(replayer.replay())
+        self.assertEqual(len(responses), 2)
+        self.assertEqual([uri for uri, _, _ in transport.requests],
+                         [BATCH_URI, BATCH_URI])
+        hits = [hit for _, body, _ in transport.requests
+                for hit in body.split('\n')]
+        self.assertEqual(len(hits), 32)
+        self.assertEqual(parse_qs(hits[0])['dp'], ['/my-page/'])
+        self.assertTrue(all('&qt=' in hit for hit in hits))
+
+    def test_recorded_batches(self):
+        recorder = Recorder(self.path)
+        recorder.record(TRACKING_URI, 'v=1&t=pageview')
+        recorder.record(TRACKING_URI, 'v=1&t=event')
+        recorder.record(BATCH_URI, 'v=1&t=item\nv=1&t=item&qt=5')
+        recorder.record(TRACKING_URI, 'v=1&t=' + 'x' * HIT_MAX_BYTES)
+        recorder.record(TRACKING_URI, 'v=1&t=social')
+        transport = FakeTransport()
+        replayer = Replayer(self.path, transport, stamp=False)
+        list(replayer.replay())
+        self.assertEqual([body for _, body, _ in transport.requests],
+                         ['v=1&t=pageview\nv=1&t=event',
+                          'v=1&t=item\nv=1&t=item&qt=5',
+                          'v=1&t=social'])
+        self.assertEqual(replayer.skipped, 1)
+
+    def test_headers(self):
+        recorder = Recorder(self.path)
+        for agent in ('agent/1', 'agent/1', 'agent/2'):
+            list(report('UA-123456-78', 'CID', PageView('/my-page/'),
+                        extra_headers={'user-agent': agent},
+                        transport=recorder))
+        recorder.record(TRACKING_URI, 'v=1&t=event')
+        for stamp in (True, False):
+            transport = FakeTransport()
+            list(Replayer(self.path, transport, stamp=stamp).replay())
+            self.assertEqual(
+                [(len(body.split('\n')), headers)
+                 for _, body, headers in transport.requests],
+                [(2, {'user-agent': 'agent/1'}),
+                 (1, {'user-agent': 'agent/2'}), (1, {})])
+
+    def test_expired(self):
+        recorder = Recorder(self.path)
+        recorder.record(TRACKING_URI, 'v=1&t=pageview', recorded=0)
+        recorder.record(TRACKING_URI, 'v=1&t=event')
+        transport = FakeTransport()
+        replayer = Replayer(self.path, transport, stamp=True)
+        list(replayer.replay())
+        self.assertEqual(replayer.expired, 1)
+        (_, body, _), = transport.requests
+        self.assertTrue(body.startswith('v=1&t=event&qt='))
+
+    def test_truncated(self):
+        recorder = Recorder(self.path)
+        recorder.record(TRACKING_URI, 'v=1&t=pageview')
+        recorder.record(TRACKING_URI, 'v=1&t=event')
+        with open(self.path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.path) - 1)
+        transport = FakeTransport()
+        list(Replayer(self.path, transport, stamp=False).replay())
+        self.assertEqual(transport.requests,
+                         [(BATCH_URI, 'v=1&t=pageview', {})])
+
+    def test_dead_letter(self):
+        recorder = Recorder(self.path)
+        retry = RetryPolicy(max_attempts=1)
+        list(report('UA-123456-78', 'CID', PageView('/my-page/'),
+                    extra_headers={'user-agent': 'my-user-agent 1.0'},
+                    transport=FlakyTransport([503]), retry=retry,
+                    dead_letter=recorder.dead_letter))
+        transport = FakeTransport()
+        list(Replayer(self.path, transport).replay())
+        ((_, _, headers),) = transport.requests
+        self.assertEqual(headers, {'user-agent': 'my-user-agent 1.0'})
+
+    def test_empty(self):
+        open(self.path, 'w').close()
+        self.assertEqual(list(Replayer(self.path, FakeTransport()).replay()),
+                         [])
+
+
+class ImportTest(TestCase):
+
+    def test_without_sdk(self):
+        # Block the App Engine SDK, as if it was not installed.
+        code = '\n'.join([
+            'import sys',
+            'sys.modules["google"] = None',
+            'from google_measurement_protocol import PageView, payloads',
+            'from google_measurement_protocol import validator',
+            '(hit, _), = payloads("UA-1234-5", "CID", PageView("/my-page/"))',
+            'assert validator.validate_payload(hit).keys() == ["cid"]',
+            'print(hit["dp"])'])
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         env=env)
+        self.assertEqual(output.strip(), '/my-page/')
+
+
+class DedupTest(TestCase):
+
+    def test_fingerprint(self):
+        hit = 'v=1&t=event&ec=category&ea=action'
+        self.assertEqual(fingerprint(hit),
+                         fingerprint('ea=action&z=123&v=1&t=event&qt=4000&'
+                                     'ec=category'))
+        self.assertNotEqual(fingerprint(hit),
+                            fingerprint('v=1&t=event&ec=category&ea=other'))
+
+    def test_window(self):
+        now = [0]
+        dedup = Deduplicator(window=10, max_entries=2, clock=lambda: now[0])
+        self.assertTrue(dedup.claim('t=pageview'))
+        self.assertEqual(dedup.claim('t=pageview'), None)
+        now[0] = 10
+        self.assertTrue(dedup.claim('t=pageview'))
+        self.assertTrue(dedup.claim('t=event'))
+        self.assertTrue(dedup.claim('t=item'))
+        # The oldest fingerprint was forgotten to make room.
+        self.assertTrue(dedup.claim('t=pageview'))
+        self.assertEqual(dedup.duplicates, 1)
+
+    def test_release(self):
+        dedup = Deduplicator()
+        dedup.release(dedup.claim('t=pageview'))
+        key = dedup.claim('t=pageview')
+        self.assertTrue(key)
+        dedup.confirm(key)
+        self.assertEqual(dedup.claim('t=pageview'), None)
+
+    def test_bloom(self):
+        now = [0]
+        dedup = BloomDeduplicator(window=10, capacity=1000,
+                                  clock=lambda: now[0])
+        hits = ['t=pageview&dp=/page-%d/' % i for i in range(500)]
+        keys = [dedup.claim(hit) for hit in hits]
+        self.assertTrue(all(keys))
+        self.assertFalse(any(dedup.claim(hit) for hit in hits))
+        for key in keys[:250]:
+            dedup.confirm(key)
+        for key in keys[250:]:
+            dedup.release(key)
+        now[0] = 10
+        self.assertEqual([bool(dedup.claim(hit)) for hit in hits],
+                         [False] * 250 + [True] * 250)
+        now[0] = 20
+        self.assertTrue(all(dedup.claim(hit) for hit in hits[:250]))
+        self.assertEqual(dedup.duplicates, 750)
+
+    def test_memcache(self):
+        dedup = MemcacheDeduplicator(namespace='test-dedup')
+        key = dedup.claim('t=pageview')
+        self.assertTrue(key)
+        other = MemcacheDeduplicator(namespace='test-dedup')
+        self.assertEqual(other.claim('t=pageview'), None)
+        dedup.release(key)
+        self.assertTrue(other.claim('t=pageview'))
+
+    def test_report(self):
+        transport = FakeTransport()
+        dedup = Deduplicator()
+        metrics = Metrics()
+        set_hooks(metrics)
+        try:
+            for client_id in ('CID', 'CID', 'CID2'):
+                list(report('UA-123456-78', client_id,
+                            PageView('/my-page/'), transport=transport,
+                            dedup=dedup))
+        finally:
+            set_hooks(None)
+        self.assertEqual(len(transport.requests), 2)
+        self.assertEqual(metrics.counters['dropped_duplicate'], 1)
+
+    def test_identical_hits(self):
+        transport = FakeTransport()
+        dedup = Deduplicator()
+        sock = Item('sock', Price(5, currency='USD'))
+        for _ in range(2):
+            list(report('UA-123456-78', 'CID', Transaction('T1', [sock] * 2),
+                        transport=transport, dedup=dedup))
+        self.assertEqual(len(transport.requests), 3)
+        self.assertEqual(dedup.duplicates, 3)
+        list(report('UA-123456-78', 'CID', Transaction('T1', [sock] * 3),
+                    transport=transport, dedup=dedup))
+        # The transaction, with a new total, and the third sock.
+        self.assertEqual(len(transport.requests), 5)
+
+    def test_retry_after_failure(self):
+        dedup = Deduplicator()
+        transaction = Transaction(
+            'trans-01', [Item('item-%02d' % i, Price(10, currency='USD'))
+                         for i in range(25)])
+        # The first batch fails, the second one is delivered.
+        transport = FlakyTransport([IOError('reset')])
+        self.assertRaises(IOError, list, report(
+            'UA-123456-78', 'CID', transaction, batch=True,
+            transport=transport, dedup=dedup))
+        self.assertEqual(len(transport.requests), 2)
+        # Only the hits of the failed batch are sent again.
+        for failures in ([503], []):
+            transport = FlakyTransport(failures)
+            list(report('UA-123456-78', 'CID', transaction, batch=True,
+                        transport=transport, dedup=dedup))
+            ((_, body, _),) = transport.requests
+            self.assertEqual(len(body.split('\n')), 20)
+        self.assertEqual(list(report('UA-123456-78', 'CID', transaction,
+                                     transport=transport, dedup=dedup)), [])
+        self.assertEqual(dedup.duplicates, 6 + 6 + 26)
+
+    def test_retry_policy(self):
+        dedup = Deduplicator()
+        dead = []
+        retry = RetryPolicy(max_attempts=1)
+        list(report('UA-123456-78', 'CID', PageView('/my-page/'),
+                    transport=FlakyTransport([503]), retry=retry,
+                    dead_letter=lambda *args: dead.append(args),
+                    dedup=dedup))
+        self.assertEqual(len(dead), 1)
+        transport = FakeTransport()
+        for _ in range(2):
+            list(report('UA-123456-78', 'CID', PageView('/my-page/'),
+                        transport=transport, retry=retry, dedup=dedup))
+        self.assertEqual(len(transport.requests), 1)
+
+    def test_tasklet(self):
+        dedup = Deduplicator()
+        transport = FakeTransport()
+        for _ in range(2):
+            report_tasklet('UA-123456-78', 'CID', PageView('/my-page/'),
+                           transport=transport, dedup=dedup).get_result()
+        self.assertEqual(len(transport.requests), 1)
+
+    def test_invalid_hit(self):
+        dedup = Deduplicator()
+        view = PageView('/my-page/').get_payload()
+        transport = FakeTransport()
+        self.assertRaises(InvalidHit, report_async, 'UA-123456-78',
+                          '35009a79-1a05-49d7-b876-2b884d0f825b',
+                          [view, {'t': 'mock'}], validate=VALIDATE_RAISE,
+                          transport=transport, dedup=dedup)
+        report_async('UA-123456-78', '35009a79-1a05-49d7-b876-2b884d0f825b',
+                     [view], validate=VALIDATE_RAISE, transport=transport,
+                     dedup=dedup)
+        self.assertEqual(len(transport.requests), 1)
+        self.assertEqual(dedup.duplicates, 0)
+
+
+class SamplerTest(TestCase):
+
+    def test_sample(self):
+        sampler = Sampler(rate=0.5)
+        sampled = [sampler.sample('client-%d' % i) for i in range(1000)]
+        self.assertTrue(400 < sum(sampled) < 600)
+        self.assertEqual(
+            sampled, [Sampler(rate=0.5).sample('client-%d' % i)
+                      for i in range(1000)])
+        self.assertTrue(Sampler(rate=1).sample('client-0'))
+        self.assertFalse(Sampler(rate=0).sample('client-0'))
+
+    def test_token_bucket(self):
+        now = [0]
+        bucket = TokenBucket(2, 5, clock=lambda: now[0])
+        self.assertEqual(bucket.refill(), 5)
+        bucket.tokens = 0
+        now[0] = 1
+        self.assertEqual(bucket.refill(), 2)
+        now[0] = 10
+        self.assertEqual(bucket.refill(), 5)
+
+    def test_allow(self):
+        now = [0]
+        sampler = Sampler(per_hit_type=(1, 2), per_client=(10, 3),
+                          clock=lambda: now[0])
+        allowed = [sampler.allow('UA-123456-78', 'CID', 'event')
+                   for _ in range(3)]
+        self.assertEqual(allowed, [True, True, False])
+        self.assertTrue(sampler.allow('UA-123456-78', 'CID', 'pageview'))
+        self.assertFalse(sampler.allow('UA-123456-78', 'CID', 'pageview'))
+        self.assertTrue(sampler.allow('UA-123456-78', 'CID2', 'pageview'))
+        self.assertEqual(sampler.limited, 2)
+
+    def test_report(self):
+        transport = FakeTransport()
+        sampler = Sampler(per_client=(0, 2))
+        for i in range(3):
+            list(report('UA-123456-78', 'CID', PageView('/page-%d/' % i),
+                        transport=transport, sampler=sampler))
+        self.assertEqual(len(transport.requests), 2)
+
+    def test_sampled_out(self):
+        sampler = Sampler(rate=0)
+        transaction = Transaction(
+            'trans-01', [Item('item-%02d' % i, Price(10, currency='USD'))
+                         for i in range(5)])
+        self.assertEqual(list(encoded_payloads(
+            'UA-123456-78', 'CID', transaction, sampler=sampler)), [])
+        self.assertEqual(sampler.sampled_out, 6)
+
+    def test_whole_requestable(self):
+        items = [Item('item-%02d' % i, Price(10, currency='USD'))
+                 for i in range(30)]
+        hits = list(encoded_payloads('UA-123456-78', 'CID',
+                                     Transaction('trans-01', items),
+                                     sampler=Sampler(rate=1.0)))
+        self.assertEqual(len(hits), 31)
+        now = [0]
+        sampler = Sampler(per_client=(1, 5), clock=lambda: now[0])
+        transaction = Transaction('trans-01', items[:3])
+        for expected in (4, 0):
+            hits = list(encoded_payloads('UA-123456-78', 'CID', transaction,
+                                         sampler=sampler))
+            self.assertEqual(len(hits), expected)
+        self.assertEqual(sampler.limited, 4)
+        # Larger than the bucket, but let through once it is full.
+        now[0] = 10
+        hits = list(encoded_payloads('UA-123456-78', 'CID',
+                                     Transaction('trans-01', items),
+                                     sampler=sampler))
+        self.assertEqual(len(hits), 31)
+        self.assertFalse(sampler.allow('UA-123456-78', 'CID', 'event'))
+
+
+class TransportTest(TestCase):
+
+    def test_fake_transport(self):
+        transport = FakeTransport()
+        mr = MockRequestable()
+        (response,) = report('UA-123456-78', 'CID', mr, transport=transport,
+                             extra_headers={'user-agent': 'my-user-agent 1.0'})
+        self.assertEqual(parse_qs(response.content)['t'], ['mock'])
+        ((uri, body, headers),) = transport.requests
+        self.assertEqual(uri, TRACKING_URI)
+        self.assertEqual(body, response.content)
+        self.assertEqual(headers, {'user-agent': 'my-user-agent 1.0'})
+
+    def test_deferred_reporter(self):
+        transport = FakeTransport()
+        reporter = DeferredReporter(LocalQueue(), transport=transport)
+        reporter.report('UA-123456-78', 'CID', PageView('/my-page/'))
+        reporter.report('UA-123456-78', 'CID', PageView('/other-page/'))
+        self.assertEqual(reporter.process(), 2)
+        ((uri, body, _),) = transport.requests
+        self.assertEqual(uri, BATCH_URI)
+        self.assertEqual(len(body.split('\n')), 2)
+
+    def test_http_transport(self):
+        connections = []
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                connections.append(self.client_address)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['content-length']))
+                self.send_response(200)
+                self.send_header('content-length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        uri = 'http://127.0.0.1:%d/collect' % server.server_port
+        transport = HTTPTransport()
+        try:
+            for i in range(3):
+                response = transport.post(uri, 't=mock&i=%d' % i, {}).get_result()
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.content, 't=mock&i=%d' % i)
+        finally:
+            transport.close()
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(len(connections), 1)
+
+    def _serve(self, respond):
+        requests = []
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['content-length']))
+                requests.append(body)
+                respond(self)
+                self.send_response(200)
+                self.send_header('content-length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+            def handle_error(self, request, client_address):
+                # Clients giving up on a slow response close the connection.
+                pass
+
+        server = Server(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return 'http://127.0.0.1:%d/collect' % server.server_port, requests
+
+    def test_http_transport_stale_connection(self):
+
+        def respond(handler):
+            # Leave the client with an idle connection closed by the server.
+            handler.close_connection = True
+
+        uri, requests = self._serve(respond)
+        transport = HTTPTransport()
+        self.addCleanup(transport.close)
+        for i in range(2):
+            response = transport.post(uri, 't=mock&i=%d' % i, {}).get_result()
+            self.assertEqual(response.content, 't=mock&i=%d' % i)
+        self.assertEqual(requests, ['t=mock&i=0', 't=mock&i=1'])
+
+    def test_http_transport_timeout(self):
+
+        def respond(handler):
+            if len(requests) > 1:
+                time.sleep(0.5)
+
+        uri, requests = self._serve(respond)
+        transport = HTTPTransport(deadline=0.1)
+        self.addCleanup(transport.close)
+        transport.post(uri, 't=mock&i=0', {}).get_result()
+        future = transport.post(uri, 't=mock&i=1', {})
+        self.assertIsInstance(future.get_exception(), transport.errors)
+        time.sleep(0.2)
+        self.assertEqual(requests, ['t=mock&i=0', 't=mock&i=1'])
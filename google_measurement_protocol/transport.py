@@ -0,0 +1,185 @@
+from collections import namedtuple
+import errno
+import threading
+import urlparse
+
+
+class Transport(object):
+    """Send request bodies to Google Analytics.
+
+    `post()` returns a future with the interface of an NDB future, including
+    `add_callback()`, whose result has `status_code`, `content` and `headers`
+    attributes. `errors` holds the exception classes raised for requests
+    that failed.
+    """
+
+    errors = ()
+
+    def post(self, uri, body, headers, deadline=None):
+        raise NotImplementedError()
+
+
+class UrlfetchTransport(Transport):
+    """Send requests with URL Fetch, through the current NDB context.
+
+    The App Engine SDK is only imported once the transport is used.
+    """
+
+    @property
+    def errors(self):
+        from google.appengine.api import urlfetch
+        return (urlfetch.Error,)
+
+    def post(self, uri, body, headers, deadline=None):
+        from google.appengine.api import urlfetch
+        from google.appengine.ext import ndb
+        if deadline is None:
+            deadline = urlfetch.get_default_fetch_deadline()
+        return ndb.get_context().urlfetch(uri, payload=body, method='POST',
+                                          headers=headers, deadline=deadline)
+
+
+Response = namedtuple('Response', 'status_code content headers')
+
+
+class Result(object):
+    """A future of a request that has already completed."""
+
+    def __init__(self, result=None, exception=None):
+        self._result = result
+        self._exception = exception
+
+    def done(self):
+        return True
+
+    def wait(self):
+        pass
+
+    def get_exception(self):
+        return self._exception
+
+    def check_success(self):
+        if self._exception is not None:
+            raise self._exception
+
+    def get_result(self):
+        self.check_success()
+        return self._result
+
+    def add_callback(self, callback, *args, **kwargs):
+        callback(*args, **kwargs)
+
+
+class HTTPTransport(Transport):
+    """Send requests over pooled keep-alive HTTP connections.
+
+    For use outside of App Engine. Up to `max_connections` idle connections
+    are kept per host, so consecutive requests reuse the TLS session instead
+    of connecting again. Requests are sent synchronously.
+    """
+
+    @property
+    def errors(self):
+        import httplib
+        import socket
+        return (httplib.HTTPException, socket.error)
+
+    def __init__(self, max_connections=10, deadline=10):
+        self.max_connections = max_connections
+        self.deadline = deadline
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def post(self, uri, body, headers, deadline=None):
+        if deadline is None:
+            deadline = self.deadline
+        parts = urlparse.urlsplit(uri)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path
+        if parts.query:
+            path += '?' + parts.query
+        conn = self._acquire(key)
+        reused = conn is not None
+        while True:
+            if conn is None:
+                conn = self._connect(key, deadline)
+            sent = False
+            try:
+                if conn.sock is not None:
+                    conn.sock.settimeout(deadline)
+                conn.request('POST', path, body, headers)
+                sent = True
+                response = conn.getresponse()
+                content = response.read()
+            except self.errors as e:
+                conn.close()
+                if reused and _stale(e, sent):
+                    # The server closed the idle connection before handling
+                    # the request, so sending it again cannot duplicate it.
+                    conn = None
+                    reused = False
+                    continue
+                return Result(exception=e)
+            break
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(key, conn)
+        return Result(Response(response.status, content,
+                               dict(response.getheaders())))
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.itervalues():
+            for conn in connections:
+                conn.close()
+
+    def _connect(self, key, deadline):
+        import httplib
+        scheme, netloc = key
+        if scheme == 'https':
+            return httplib.HTTPSConnection(netloc, timeout=deadline)
+        return httplib.HTTPConnection(netloc, timeout=deadline)
+
+    def _acquire(self, key):
+        with self._lock:
+            connections = self._idle.get(key)
+            if connections:
+                return connections.pop()
+
+    def _release(self, key, conn):
+        with self._lock:
+            connections = self._idle.setdefault(key, [])
+            if len(connections) < self.max_connections:
+                connections.append(conn)
+                return
+        conn.close()
+
+
+def _stale(error, sent):
+    """Return whether `error` shows a connection was closed while idle."""
+    import httplib
+    import socket
+    if isinstance(error, socket.timeout):
+        return False
+    if sent:
+        return isinstance(error, httplib.BadStatusLine)
+    return getattr(error, 'errno', None) in (errno.ECONNRESET, errno.EPIPE)
+
+
+class FakeTransport(Transport):
+    """Record requests instead of sending them, for tests.
+
+    Requests are kept in `requests` as (uri, body, headers) tuples and
+    answered with `status_code` and the request body as content.
+    """
+
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+        self.requests = []
+
+    def post(self, uri, body, headers, deadline=None):
+        self.requests.append((uri, body, headers))
+        return Result(Response(self.status_code, body, {}))
@@ -1,15 +1,53 @@
-import gettext
 import re
-import uuid
+import threading
 
 from . import iso4217
 
-_ = gettext.gettext
+def _(message):
+    from gettext import gettext
+    return gettext(message)
 
 class ValidationError(Exception):
     """An error while validating data."""
     pass
 
+class Domain(frozenset):
+    """
+    A validator accepting a fixed set of values, with constant time lookups.
+
+    >>> is_color = Domain(("red", "green"))
+    >>> assert is_color("red")
+    >>> assert not is_color("blue")
+    >>> assert not is_color(["red"])
+    """
+
+    def __call__(self, value):
+        try:
+            return value in self
+        except TypeError:
+            return False
+
+class _LazyPattern(object):
+    """
+    A regular expression compiled when first used, to keep imports fast.
+
+    >>> digits = _LazyPattern(r"\d+$")
+    >>> bool(digits.match("42"))
+    True
+    """
+
+    def __init__(self, pattern, flags=0):
+        self.pattern = pattern
+        self.flags = flags
+
+    def __getattr__(self, name):
+        compiled = re.compile(self.pattern, self.flags)
+        # Later lookups find the methods without going through here.
+        for method in ("match", "search", "sub", "split", "findall",
+                       "finditer"):
+            setattr(self, method, getattr(compiled, method))
+        return getattr(compiled, name)
+
 def is_boolean(value):
     return value in (0, 1)
 
@@ -19,10 +57,22 @@ def is_integer(value):
 def is_currency(value):
     return isinstance(value, (int, float)) and 0 <= value
 
+def is_v(value):
+    """
+    >>> assert is_v("1")
+    >>> assert not is_v("2")
+    >>> assert not is_v(None)
+    """
+    return value in ("1", 1)
+
+def validate_v(value):
+    if not is_v(value):
+        raise ValidationError(_("Enter a valid 'v' (Protocol Version)."))
+
 # see:
 # http://stackoverflow.com/questions/2497294/regular-expression-to-validate-a-google-analytics-ua-number
 # http://stackoverflow.com/questions/20411767/how-to-validate-google-analytics-tracking-id-using-a-javascript-function
-tid_regex = re.compile(r"^(UA|YT|MO)-\d{4,10}-\d{1,4}$")
+tid_regex = _LazyPattern(r"^(UA|YT|MO)-\d{4,10}-\d{1,4}$")
 
 def is_tid(value):
     """
@@ -36,6 +86,8 @@ def validate_tid(value):
     if not is_tid(value):
         raise ValidationError(_("Enter a valid 'tid' (Tracking ID / Web Property ID)."))
 
+anonymize_ip_values = Domain(("", 0, 1))
+
 def is_aip(value):
     """
     >>> assert is_aip("")
@@ -43,7 +95,7 @@ def is_aip(value):
     >>> assert is_aip(1)
     >>> assert not is_aip(None)
     """
-    return value in ("", 0, 1)
+    return anonymize_ip_values(value)
 
 def validate_aip(value):
     if not is_aip(value):
@@ -55,79 +107,308 @@ def validate_qt(value):
     if not is_qt(value):
         raise ValidationError(_("Enter a valid 'qt' (Queue Time)."))
 
-cid_regex = re.compile(r"^[0-9A-F]{8}-[0-9A-F]{4}-[0-9A-F]{4}-[0-9A-F]{4}-[0-9A-F]{12}$", re.IGNORECASE)
+cid_regex = _LazyPattern(r"^[0-9A-F]{8}-[0-9A-F]{4}-[0-9A-F]{4}-[0-9A-F]{4}-[0-9A-F]{12}$", re.IGNORECASE)
+
+_uuid_chars = "0123456789abcdefABCDEF-"
+_missing = object()
+
+class LRUCache(object):
+    """
+    A bounded cache keeping recently used entries.
+
+    Entries live in two generations of at most `maxsize / 2` entries. Once
+    the current generation is full it replaces the previous one, evicting
+    the entries not used since. This approximates LRU eviction with plain
+    dict operations only.
+
+    >>> cache = LRUCache(4)
+    >>> cache.set("a", 1)
+    >>> cache.set("b", 2)
+    >>> cache.set("c", 3)
+    >>> cache.get("a")
+    1
+    >>> cache.set("d", 4)
+    >>> cache.set("e", 5)
+    >>> cache.get("b") is None
+    True
+    >>> len(cache)
+    4
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._generation_size = max(maxsize // 2, 1)
+        self._current = {}
+        self._previous = {}
+
+    def __len__(self):
+        return len(self._current) + len(self._previous)
+
+    def get(self, key, default=None):
+        value = self._current.get(key, _missing)
+        if value is not _missing:
+            return value
+        value = self._previous.pop(key, _missing)
+        if value is _missing:
+            return default
+        self._set(key, value)
+        return value
+
+    def set(self, key, value):
+        self._set(key, value)
+
+    def _set(self, key, value):
+        if len(self._current) >= self._generation_size:
+            self._previous = self._current
+            self._current = {}
+        self._current[key] = value
+
+    def clear(self):
+        self._current = {}
+        self._previous = {}
+
+class MemoCache(LRUCache):
+    """
+    An `LRUCache` safe to share between threads, counting lookups.
+
+    >>> cache = MemoCache(4)
+    >>> cache.get("a") is None
+    True
+    >>> cache.set("a", True)
+    >>> cache.get("a")
+    True
+    >>> sorted(cache.stats().items())
+    [('hit_rate', 0.5), ('hits', 1), ('misses', 1), ('size', 1)]
+    """
+
+    def __init__(self, maxsize=1024):
+        super(MemoCache, self).__init__(maxsize)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = super(MemoCache, self).get(key, _missing)
+            if value is _missing:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            super(MemoCache, self).set(key, value)
+
+    def clear(self):
+        with self._lock:
+            super(MemoCache, self).clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "size": len(self),
+                "hit_rate": float(self.hits) / lookups if lookups else 0.0}
+
+_cid_cache = None
+
+def enable_cid_cache(maxsize=1024):
+    """
+    Remember the validity of the last `maxsize` client IDs checked by
+    `is_cid`, as the same client ID comes with every hit of a session.
+    `maxsize=None` disables the cache.
+    """
+    global _cid_cache
+    _cid_cache = LRUCache(maxsize) if maxsize else None
 
 def is_cid(value):
     """
     >>> assert is_cid("35009a79-1a05-49d7-b876-2b884d0f825b")
+    >>> assert is_cid(u"35009A79-1A05-49D7-B876-2B884D0F825B")
     >>> assert not is_cid("35009a791a0549d7b8762b884d0f825b")
+    >>> assert not is_cid("{35009a79-1a05-49d7-b876-2b884d0f825b}")
+    >>> assert not is_cid("35009a79-1a05-39d7-b876-2b884d0f825b")
+    >>> assert not is_cid("35009a79-1a05-49d7-7876-2b884d0f825b")
+    >>> assert not is_cid("35009a79-1a05-49d7-b876-2b884d0f825g")
+    >>> assert not is_cid("35009a79-1a05-49d7-b876-2b884d0f-25b")
     >>> assert not is_cid(None)
     """
-    try:
-        u = uuid.UUID(value)
-    except Exception:
-        return False
-    else:
-        if bool(cid_regex.match(value)):
-            return u.version == 4
-        else:
+    if isinstance(value, unicode):
+        try:
+            value = value.encode("ascii")
+        except UnicodeError:
             return False
+    elif not isinstance(value, str):
+        return False
+    cache = _cid_cache
+    if cache is not None:
+        valid = cache.get(value)
+        if valid is not None:
+            return valid
+    # A canonical UUID: hex digits with hyphens at fixed positions, version 4
+    # and the RFC 4122 variant.
+    valid = (len(value) == 36 and
+             value[8] == value[13] == value[18] == value[23] == "-" and
+             value[14] == "4" and value[19] in "89abAB" and
+             not value.translate(None, _uuid_chars) and
+             value.count("-") == 4)
+    if cache is not None:
+        cache.set(value, valid)
+    return valid
 
 def validate_cid(value):
     if not is_cid(value):
         raise ValidationError(_("Enter a valid 'cid' (Client ID)."))
 
+session_controls = Domain(("start", "end"))
+
 def is_sc(value):
     """
     >>> assert is_sc("start")
     >>> assert is_sc("end")
     >>> assert not is_sc(None)
     """
-    return value in ("start", "end")
+    return session_controls(value)
 
 def validate_sc(value):
     if not is_sc(value):
         raise ValidationError(_("Enter a valid 'sc' (Session Control)."))
 
-# see:
-# https://github.com/django/django/blob/master/django/core/validators.py
-ipv4_regex = re.compile(r"^(25[0-5]|2[0-4]\d|[0-1]?\d?\d)(\.(25[0-5]|2[0-4]\d|[0-1]?\d?\d)){3}$")
+# Addresses, host names and URLs are checked by scanning them once, after
+# checking their length, as regular expressions matching them backtrack badly
+# on some input.
 
-# see:
-# http://home.deds.nl/~aeron/regex/
-ipv6_regex = re.compile(r"^(((?=.*(::))(?!.*\3.+\3))\3?|[\dA-F]{1,4}:)([\dA-F]{1,4}(\3|:\b)|\2){5}(([\dA-F]{1,4}(\3|:\b|$)|\2){2}|(((2[0-4]|1\d|[1-9])?\d|25[0-5])\.?\b){4})\Z", re.IGNORECASE)
+_digits = "0123456789"
+_hex_digits = "0123456789abcdefABCDEF"
+_letters = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+_host_chars = _letters + _digits + "-."
+_scheme_chars = _letters + _digits + ".-"
+_ipv6_chars = _hex_digits + ":."
+_whitespace_regex = _LazyPattern(r"\s")
+
+def _only(value, chars):
+    return not value.translate(None, chars)
+
+def _is_ipv4(value, leading_zeros=True):
+    parts = value.split(".")
+    if len(parts) != 4:
+        return False
+    for part in parts:
+        if not 0 < len(part) <= 3 or not part.isdigit() or int(part) > 255:
+            return False
+        if not leading_zeros and len(part) > 1 and part[0] == "0":
+            return False
+    return True
+
+def _is_ipv6(value):
+    if not _only(value, _ipv6_chars):
+        return False
+    head, compressed, tail = value.partition("::")
+    fields = []
+    for part in (head, tail):
+        if part:
+            fields.extend(part.split(":"))
+    count = 0
+    if fields and "." in fields[-1]:
+        # An IPv4 address can only end the address, without leading zeros.
+        if (compressed and not tail) or not _is_ipv4(fields.pop(), False):
+            return False
+        count = 2
+    for field in fields:
+        if not 0 < len(field) <= 4 or "." in field:
+            return False
+    count += len(fields)
+    return count < 8 if compressed else count == 8
 
 def is_uip(value):
     """
     >>> assert is_uip("1.2.3.4")
     >>> assert is_uip("2607:f0d0:1002:51::4")
     >>> assert is_uip("2607:f0d0:1002:0051:0000:0000:0000:0004")
+    >>> assert is_uip("::ffff:192.0.2.1")
+    >>> assert is_uip("::")
+    >>> assert not is_uip("1.2.3.256")
+    >>> assert not is_uip("::ffff:192.0.02.1")
+    >>> assert not is_uip("2607:f0d0:1002:51::4::1")
+    >>> assert not is_uip("2607:f0d0:1002:51:4:1:2")
     >>> assert not is_uip(None)
     """
-    return isinstance(value, str) and (bool(ipv4_regex.match(value)) or bool(ipv6_regex.match(value)))
+    if not isinstance(value, str) or len(value) > 45:
+        return False
+    if ":" in value:
+        return _is_ipv6(value)
+    return _is_ipv4(value)
+
+def _is_domain(value):
+    if not _only(value, _host_chars):
+        return False
+    labels = value.split(".")
+    if labels[-1] == "":
+        labels.pop()
+    if len(labels) < 2:
+        return False
+    tld = labels.pop()
+    if not (2 <= len(tld) <= 6 and tld.isalpha() or
+            len(tld) >= 2 and tld[-1] != "-"):
+        return False
+    for label in labels:
+        if not 0 < len(label) <= 63 or label[0] == "-" or label[-1] == "-":
+            return False
+    return True
+
+def _is_dotted_quad(value):
+    parts = value.split(".")
+    return len(parts) == 4 and all(
+        0 < len(part) <= 3 and part.isdigit() for part in parts)
+
+def _is_ipv6_literal(value):
+    if value[:1] == "[":
+        value = value[1:]
+    if value[-1:] == "]":
+        value = value[:-1]
+    colon = value.find(":")
+    return 0 <= colon < len(value) - 1 and _only(value, _hex_digits + ":")
+
+def _is_host_name(value):
+    return (_is_domain(value) or _is_dotted_quad(value) or
+            _is_ipv6_literal(value) or value.lower() == "localhost")
+
+def _is_host(value):
+    """
+    Whether `value` is a domain name, localhost or an IP address, optionally
+    followed by a port, as accepted by Django's URL validator.
+    """
+    if _is_host_name(value):
+        return True
+    host, colon, port = value.rpartition(":")
+    return bool(host) and port.isdigit() and _is_host_name(host)
+
+def _is_url(value):
+    scheme, separator, rest = value.partition("://")
+    if not separator or not _only(scheme, _scheme_chars):
+        return False
+    end = rest.find("/")
+    if end < 0:
+        end = len(rest)
+    query = rest.find("?", 0, end)
+    if query >= 0:
+        end = query
+    path = rest[end:]
+    if path and path != "/" and (len(path) == 1 or _whitespace_regex.search(path)):
+        return False
+    return _is_host(rest[:end])
 
 def validate_uip(value):
     if not is_uip(value):
         raise ValidationError(_("Enter a valid 'uip' (IP Override)."))
 
-# see:
-# https://github.com/django/django/blob/master/django/core/validators.py
-url_regex = re.compile(
-    r'^(?:[a-z0-9\.\-]*)://'  # scheme is validated separately
-    r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}(?<!-)\.?)|'  # domain...
-    r'localhost|'  # localhost...
-    r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}|'  # ...or ipv4
-    r'\[?[A-F0-9]*:[A-F0-9:]+\]?)'  # ...or ipv6
-    r'(?::\d+)?'  # optional port
-    r'(?:/?|[/?]\S+)$'
-, re.IGNORECASE)
-
 def is_dr(value):
     """
     >>> assert is_dr("http://example.com")
     >>> assert not is_dr(None)
     """
-    return isinstance(value, str) and bool(url_regex.match(value)) and len(value) <= 2048
+    return isinstance(value, str) and len(value) <= 2048 and _is_url(value)
 
 def validate_dr(value):
     if not is_dr(value):
@@ -271,12 +552,14 @@ def validate_fl(value):
     if not is_fl(value):
         raise ValidationError(_("Enter a valid 'fl' (Flash Version)."))
 
+hit_types = Domain(("pageview", "screenview", "event", "transaction", "item", "social", "exception", "timing"))
+
 def is_t(value):
     """
     >>> assert is_t("pageview")
     >>> assert not is_t(None)
     """
-    return value in ("pageview", "screenview", "event", "transaction", "item", "social", "exception", "timing")
+    return hit_types(value)
 
 def validate_t(value):
     if not is_t(value):
@@ -291,36 +574,31 @@ def validate_ni(value):
 def is_dl(value):
     """
     >>> assert is_dl("http://foo.com/home?a=b")
+    >>> assert is_dl("https://[2607:f0d0::4]:8080/")
+    >>> assert not is_dl("http://foo.com/home page")
+    >>> assert not is_dl("http://" + "a." * 100000 + "com")
     >>> assert not is_dl(None)
     """
-    return isinstance(value, str) and bool(url_regex.match(value)) and len(value) <= 2048
+    return isinstance(value, str) and len(value) <= 2048 and _is_url(value)
 
 def validate_dl(value):
     if not is_dl(value):
         raise ValidationError(_("Enter a valid 'dl' (Document location URL)."))
 
-host_regex = re.compile(
-    r'^'
-    r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}(?<!-)\.?)|'  # domain...
-    r'localhost|'  # localhost...
-    r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}|'  # ...or ipv4
-    r'\[?[A-F0-9]*:[A-F0-9:]+\]?)'  # ...or ipv6
-    r'(?::\d+)?'  # optional port
-    r'$'
-, re.IGNORECASE)
-
 def is_dh(value):
     """
     >>> assert is_dh("foo.com")
+    >>> assert is_dh("localhost:8080")
+    >>> assert not is_dh("-foo.com")
     >>> assert not is_dh(None)
     """
-    return isinstance(value, str) and bool(host_regex.match(value)) and len(value) <= 100
+    return isinstance(value, str) and len(value) <= 100 and _is_host(value)
 
 def validate_dh(value):
     if not is_dh(value):
         raise ValidationError(_("Enter a valid 'dh' (Document Host Name)."))
 
-path_regex = re.compile(
+path_regex = _LazyPattern(
     r'^'
     r'(?:/?|[/?]\S+)'
     r'$'
@@ -527,12 +805,14 @@ def validate_iv(value):
     if not is_iv(value):
         raise ValidationError(_("Enter a valid 'iv' (Item Category)."))
 
+currency_codes = Domain(iso4217.codes)
+
 def is_cu(value):
     """
     >>> assert is_cu("EUR")
     >>> assert not is_cu(None)
     """
-    return value in iso4217.codes
+    return currency_codes(value)
 
 def validate_cu(value):
     if not is_cu(value):
@@ -562,12 +842,14 @@ def validate_prcm(value):
     if not is_prcm(value):
         raise ValidationError(_("Enter a valid 'pr[\d+]cm[index]' (Product Custom Metric)."))
 
+product_actions = Domain(("detail", "click", "add", "remove", "checkout", "checkout_option", "purchase", "refund"))
+
 def is_pa(value):
     """
     >>> assert is_pa("detail")
     >>> assert not is_pa(None)
     """
-    return value in ("detail", "click", "add", "remove", "checkout", "checkout_option", "purchase", "refund")
+    return product_actions(value)
 
 def validate_pa(value):
     if not is_pa(value):
@@ -749,3 +1031,162 @@ def is_xid(value):
 def validate_xid(value):
     if not is_xid(value):
         raise ValidationError(_("Enter a valid 'xid' (Experiment ID)."))
+
+def _to_int(value):
+    if isinstance(value, basestring):
+        try:
+            return int(value)
+        except ValueError:
+            pass
+    return value
+
+def _to_float(value):
+    if isinstance(value, basestring):
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    return value
+
+def _to_str(value):
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    return value
+
+# Parameters carrying an index, mapped to the name of their validators.
+_indexed_params = (
+    ("cd_", r"cd[1-9][0-9]*"),
+    ("cm_", r"cm[1-9][0-9]*"),
+    ("prpr", r"pr[1-9][0-9]*pr"),
+    ("prqt", r"pr[1-9][0-9]*qt"),
+    ("prps", r"pr[1-9][0-9]*ps"),
+    ("prcm", r"pr[1-9][0-9]*cm[1-9][0-9]*"),
+    ("ilpips", r"il[1-9][0-9]*pi[1-9][0-9]*ps"),
+    ("ilpipr", r"il[1-9][0-9]*pi[1-9][0-9]*pr"),
+    ("ilpicm", r"il[1-9][0-9]*pi[1-9][0-9]*cm[1-9][0-9]*"),
+)
+
+indexed_param_regex = _LazyPattern(
+    r"^(?:%s)$" % "|".join("(?P<%s>%s)" % param for param in _indexed_params))
+
+_required_params = ("v", "tid", "cid", "t")
+
+def _validator(name):
+    is_valid = globals()["is_" + name]
+    if is_valid in (is_integer, is_boolean, is_aip):
+        coerce = _to_int
+    elif is_valid is is_currency:
+        coerce = _to_float
+    else:
+        coerce = _to_str
+    return is_valid, globals()["validate_" + name], coerce
+
+_indexed_validators = dict(
+    (name, _validator(name)) for name, _ in _indexed_params)
+
+_fixed_validators = dict(
+    (name[len("validate_"):], _validator(name[len("validate_"):]))
+    for name in list(globals())
+    if name.startswith("validate_") and name != "validate_payload" and
+    name[len("validate_"):] not in _indexed_validators)
+
+# Indexed parameter names resolved so far, bounded to keep hostile input from
+# growing it without limit.
+_indexed_cache = {}
+_INDEXED_CACHE_SIZE = 10000
+
+def validate_payload(payload):
+    """
+    Validate every parameter of a hit in one pass.
+
+    Returns a dict mapping invalid parameters to error messages, which is
+    empty for a valid hit. Values may be given in their wire format, so
+    `"7"` is accepted for an integer. Unknown parameters are ignored.
+
+    >>> validate_payload({"v": "1", "tid": "UA-1234-5", "t": "event",
+    ...                   "cid": "35009a79-1a05-49d7-b876-2b884d0f825b",
+    ...                   "ev": "7", "cd3": "Sports", "pr2qt": 2, "z": "1"})
+    {}
+    >>> errors = validate_payload({"v": "1", "tid": "UA-1234-5", "t": "hit",
+    ...                            "cm2": "many", "il1pi3ps": "-1"})
+    >>> sorted(errors)
+    ['cid', 'cm2', 'il1pi3ps', 't']
+    >>> errors["t"]
+    "Enter a valid 't' (Hit type)."
+    """
+    errors = {}
+    for name in _required_params:
+        if name not in payload and not (name == "cid" and "uid" in payload):
+            errors[name] = _("Missing required parameter '%s'.") % name
+    for name, value in payload.iteritems():
+        validator = _fixed_validators.get(name)
+        if validator is None:
+            try:
+                validator = _indexed_cache[name]
+            except KeyError:
+                match = indexed_param_regex.match(name)
+                if match is not None:
+                    validator = _indexed_validators[match.lastgroup]
+                if len(_indexed_cache) < _INDEXED_CACHE_SIZE:
+                    _indexed_cache[name] = validator
+            if validator is None:
+                continue
+        is_valid, validate, coerce = validator
+        value = coerce(value)
+        if not is_valid(value):
+            try:
+                validate(value)
+            except ValidationError as e:
+                errors[name] = e.args[0]
+    return errors
+
+# Validators memoized by `enable_memoization`, mapped to the originals.
+_memoized = {}
+
+def _memoize(is_valid, cache):
+    def memoized(value):
+        if not isinstance(value, str):
+            return is_valid(value)
+        valid = cache.get(value)
+        if valid is None:
+            valid = is_valid(value)
+            cache.set(value, valid)
+        return valid
+    memoized.__name__ = is_valid.__name__
+    memoized.__doc__ = is_valid.__doc__
+    memoized.cache = cache
+    return memoized
+
+def enable_memoization(maxsize=4096, params=("dl", "dr", "dh", "dp")):
+    """
+    Remember the validity of the last `maxsize` values of each of `params`,
+    whose validators run costly regular expressions on values that sites
+    send over and over. Caches are shared by all threads of the process.
+    `maxsize=None` restores the plain validators.
+
+    >>> enable_memoization(16, params=("dh",))
+    >>> "dh" in validate_payload({"dh": "foo.com"})
+    False
+    >>> validate_dh("foo.com")
+    >>> memoization_stats()["dh"]["hits"]
+    1
+    >>> enable_memoization(None)
+    >>> memoization_stats()
+    {}
+    """
+    for param in list(_memoized):
+        is_valid = _memoized.pop(param)
+        globals()["is_" + param] = is_valid
+        _fixed_validators[param] = _validator(param)
+    if not maxsize:
+        return
+    for param in params:
+        is_valid = globals()["is_" + param]
+        _memoized[param] = is_valid
+        globals()["is_" + param] = _memoize(is_valid, MemoCache(maxsize))
+        _fixed_validators[param] = _validator(param)
+
+def memoization_stats():
+    """Return the `MemoCache.stats()` of each memoized parameter."""
+    return dict((param, globals()["is_" + param].cache.stats())
+                for param in _memoized)
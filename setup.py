@@ -5,9 +5,11 @@ def test_suite():
     import doctest
     import unittest
 
+    import google_measurement_protocol.iso4217
     import google_measurement_protocol.validator
 
     suite = unittest.TestLoader().discover('google_measurement_protocol.tests')
+    suite.addTest(doctest.DocTestSuite(google_measurement_protocol.iso4217))
     suite.addTest(doctest.DocTestSuite(google_measurement_protocol.validator))
     return suite
 
@@ -29,6 +31,11 @@ setup(name='google-measurement-protocol-ndb',
       license='BSD',
       version='0.1.3',
       packages=['google_measurement_protocol'],
+      entry_points={
+          'console_scripts': [
+              'gmp-import = google_measurement_protocol.bulk:main',
+          ],
+      },
       test_suite='setup.test_suite',
       tests_require=['pytest-cov>=1.7,<1.8a0', 'minimock>=1.2,<1.3a0', 'prices>=0.5,<0.6a0'],
       classifiers=CLASSIFIERS,